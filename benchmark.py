@@ -0,0 +1,280 @@
+import os
+import io
+import bz2
+import sys
+import json
+import math
+import time
+import shlex
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+from itertools import accumulate
+from bz2paralelo import leer_lineas
+from grafos import exportar_grafo
+from filtro import leer_filtro
+from generador import Tweet, acumular_menciones, filtrar_lineas, crear_agregados, agregar_tweet
+from generador import json_retweets, json_menciones, json_corretweets, calcular_corretweets, podar_grafo, generar_grafo_corretweets
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+INICIO_CORPUS = datetime(2016, 1, 1)
+TIPOS = ['retweets', 'menciones', 'corretweets', 'grafo_retweets', 'grafo_menciones']
+OPCIONES_SALIDA = ['-jrt', '-jm', '-jcrt', '-grt', '-gm', '-gcrt']
+
+
+def benchmark_menciones(tamanos):
+    # Peor caso para un índice lineal: un solo usuario mencionado por fuentes todas distintas.
+    # Si el costo por mención se mantiene constante al crecer n, el tiempo total es lineal
+    resultados = []
+    for n in tamanos:
+        tweets = [Tweet('u%d' % i, str(i), None, ('popular',)) for i in range(n)]
+        mention_dict, usuarios = {}, {}
+
+        inicio = time.perf_counter()
+        for tweet in tweets:
+            acumular_menciones(mention_dict, tweet, usuarios)
+        segundos = time.perf_counter() - inicio
+
+        resultados.append({'menciones': n, 'segundos': segundos, 'us_por_mencion': segundos / n * 1e6})
+    return resultados
+
+# Corpus sintético: archivos por hora con la estructura año/mes/día/hora.json.bz2 del stream original.
+# Todo sale de un random.Random con semilla, así el mismo conjunto de parámetros da los mismos bytes
+def poisson(rng, media):
+    limite, k, p = math.exp(-media), 0, 1.0
+    while True:
+        p *= rng.random()
+        if p <= limite:
+            return k
+        k += 1
+
+def generar_corpus(directorio, tweets=100000, archivos=8, proporcion_rt=0.5, fan_menciones=1.0, usuarios=10000,
+                   sesgo=1.1, proporcion_hashtags=0.3, num_hashtags=20, semilla=0):
+    parametros = {'tweets': tweets, 'archivos': archivos, 'proporcion_rt': proporcion_rt, 'fan_menciones': fan_menciones,
+                  'usuarios': usuarios, 'sesgo': sesgo, 'proporcion_hashtags': proporcion_hashtags,
+                  'num_hashtags': num_hashtags, 'semilla': semilla}
+    manifiesto = os.path.join(directorio, 'corpus.json')
+    if os.path.exists(manifiesto):
+        with open(manifiesto) as file:
+            if json.load(file) == parametros:
+                return parametros
+        shutil.rmtree(directorio)
+
+    rng = random.Random(semilla)
+    # Popularidad con ley de potencias: el usuario i aparece con peso 1 / (i + 1) ** sesgo
+    indices = range(usuarios)
+    acumulados = list(accumulate(1 / (i + 1) ** sesgo for i in indices))
+    elegir_indice = lambda: rng.choices(indices, cum_weights=acumulados)[0]
+    elegir_usuario = lambda: 'user%d' % elegir_indice()
+    temas = ['tema%d' % i for i in range(num_hashtags)]
+    ruido = ['otro%d' % i for i in range(100)]
+
+    def hashtags_tweet():
+        elegidos = [rng.choice(ruido) for _ in range(rng.randint(0, 2))]
+        if rng.random() < proporcion_hashtags:
+            tema = rng.choice(temas)
+            elegidos.append(tema.upper() if rng.random() < 0.2 else tema)
+        return [{'text': hashtag} for hashtag in elegidos]
+
+    def tweet_base(id_tweet, fecha, usuario, menciones, hashtags):
+        # created_at primero y sin espacios, como llegan las líneas del stream
+        return {'created_at': fecha.strftime('%a %b %d %H:%M:%S +0000 %Y'), 'id_str': str(id_tweet),
+                'text': ' '.join(['@' + mencion for mencion in menciones] + ['#' + h['text'] for h in hashtags] + ['texto'] * 8),
+                'user': {'screen_name': usuario, 'lang': 'es'},
+                'entities': {'hashtags': hashtags, 'user_mentions': [{'screen_name': mencion} for mencion in menciones]}}
+
+    id_tweet = 0
+    por_archivo = tweets // archivos
+    for numero in range(archivos):
+        hora = INICIO_CORPUS + timedelta(hours=numero)
+        carpeta = os.path.join(directorio, hora.strftime('%Y/%m/%d'))
+        os.makedirs(carpeta, exist_ok=True)
+        lineas = io.StringIO()
+        cantidad = por_archivo + (tweets % archivos if numero == archivos - 1 else 0)
+        for k in range(cantidad):
+            fecha = hora + timedelta(seconds=k * 3600 // max(cantidad, 1))
+            id_tweet += 1
+            if rng.random() < proporcion_rt:
+                # Cada autor tiene 50 tweets originales posibles, así los populares acumulan varios retweets por tweet
+                indice = elegir_indice()
+                autor = 'user%d' % indice
+                original = tweet_base(10 ** 12 + indice * 50 + rng.randrange(50), fecha - timedelta(hours=1), autor,
+                                      [elegir_usuario() for _ in range(poisson(rng, fan_menciones))], hashtags_tweet())
+                tweet = tweet_base(id_tweet, fecha, elegir_usuario(), [autor] + [m['screen_name'] for m in original['entities']['user_mentions']],
+                                   original['entities']['hashtags'])
+                tweet['retweeted_status'] = original
+            else:
+                tweet = tweet_base(id_tweet, fecha, elegir_usuario(), [elegir_usuario() for _ in range(poisson(rng, fan_menciones))], hashtags_tweet())
+            lineas.write(json.dumps(tweet, separators=(',', ':')))
+            lineas.write('\n')
+            if rng.random() < 0.02:
+                lineas.write('{"delete":{"status":{"id_str":"%d"}}}\n' % rng.randrange(id_tweet))
+        with bz2.open(os.path.join(carpeta, hora.strftime('%H') + '.json.bz2'), 'wb') as f_out:
+            f_out.write(lineas.getvalue().encode('utf-8'))
+
+    with open(os.path.join(directorio, 'hashtags.txt'), 'w') as file:
+        file.write('\n'.join(temas) + '\n')
+    with open(manifiesto, 'w') as file:
+        json.dump(parametros, file)
+    return parametros
+
+def rango_corpus(parametros):
+    # Fechas -fi/-ff (dd-mm-aa, por día) que cubren todo el corpus, para que el filtro de fechas trabaje sin descartar
+    fin = INICIO_CORPUS + timedelta(hours=parametros['archivos'], days=1)
+    return INICIO_CORPUS, fin.replace(hour=0)
+
+def listar_corpus(directorio):
+    archivos = []
+    for root, dirs, files in os.walk(directorio):
+        dirs.sort()
+        archivos.extend(os.path.join(root, file) for file in sorted(files) if file.endswith('.json.bz2'))
+    return archivos
+
+def medir(etapas, nombre, funcion, *args, **kwargs):
+    inicio = time.perf_counter()
+    resultado = funcion(*args, **kwargs)
+    etapas[nombre] = time.perf_counter() - inicio
+    return resultado
+
+def benchmark_etapas(directorio, parametros, formato_grafo='gexf'):
+    # Cada etapa se mide por separado sobre el resultado en memoria de la anterior
+    archivos = listar_corpus(directorio)
+    filtro = leer_filtro(os.path.join(directorio, 'hashtags.txt'))
+    fecha_inicial, fecha_final = rango_corpus(parametros)
+    etapas = {}
+
+    lineas = medir(etapas, 'descompresion', lambda: [linea for archivo in archivos for linea in leer_lineas(archivo)])
+    medir(etapas, 'parseo', lambda: [json.loads(linea) for linea in lineas])
+    tweets = medir(etapas, 'filtro', lambda: list(filtrar_lineas(lineas, fecha_inicial, fecha_final, filtro)))
+    volumen = {'archivos': len(archivos), 'bytes_comprimidos': sum(os.path.getsize(archivo) for archivo in archivos),
+               'bytes_descomprimidos': sum(len(linea) + 1 for linea in lineas), 'lineas': len(lineas), 'tweets_filtrados': len(tweets)}
+    del lineas
+
+    # Cada tipo se agrega por separado, con su propia tabla de usuarios
+    agregados, nombres = {}, {}
+    for tipo in TIPOS:
+        parcial = crear_agregados(**{tipo: True})
+        inicio = time.perf_counter()
+        for tweet in tweets:
+            agregar_tweet(parcial, tweet)
+        etapas['agregacion_' + tipo] = time.perf_counter() - inicio
+        agregados[tipo], nombres[tipo] = parcial[tipo], list(parcial['usuarios'])
+
+    salida = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        ruta = lambda nombre: os.path.join(salida, nombre)
+        medir(etapas, 'json_retweets', json_retweets, agregados['retweets'], nombres['retweets'], ruta('rt.json'))
+        medir(etapas, 'json_menciones', json_menciones, agregados['menciones'], nombres['menciones'], ruta('mencion.json'))
+        corretweets = medir(etapas, 'calcular_corretweets', calcular_corretweets, agregados['corretweets'])
+        medir(etapas, 'json_corretweets', json_corretweets, corretweets, nombres['corretweets'], ruta('corrtw.json'))
+        del corretweets
+
+        grafo = medir(etapas, 'generar_grafo_retweets', podar_grafo, agregados['grafo_retweets'], nombres['grafo_retweets'])
+        medir(etapas, 'escritura_grafo_retweets', exportar_grafo, grafo, ruta('rt'), formato_grafo)
+        grafo = medir(etapas, 'generar_grafo_menciones', podar_grafo, agregados['grafo_menciones'], nombres['grafo_menciones'])
+        medir(etapas, 'escritura_grafo_menciones', exportar_grafo, grafo, ruta('mencion'), formato_grafo)
+        grafo = medir(etapas, 'generar_grafo_corretweets',
+                      lambda: generar_grafo_corretweets(calcular_corretweets(agregados['corretweets'], con_retweeters=False, por_autores=True),
+                                                        nombres['corretweets']))
+        medir(etapas, 'escritura_grafo_corretweets', exportar_grafo, grafo, ruta('corrtw'), formato_grafo)
+    finally:
+        shutil.rmtree(salida)
+    return etapas, volumen
+
+def benchmark_ejecuciones(directorio, parametros, workers=(1,), procesos_mpi=(), argumentos_mpi=''):
+    # Corridas completas de los scripts tal como se usan, cada una en un directorio de salida temporal
+    fecha_inicial, fecha_final = rango_corpus(parametros)
+    comunes = ['-d', os.path.abspath(directorio), '-h', os.path.abspath(os.path.join(directorio, 'hashtags.txt')),
+               '-fi', fecha_inicial.strftime('%d-%m-%y'), '-ff', fecha_final.strftime('%d-%m-%y')] + OPCIONES_SALIDA
+    comandos = [('secuencial', n, [sys.executable, os.path.join(DIRECTORIO, 'generador.py')] + comunes + ['-w', str(n), '-wcrt', str(n)])
+                for n in workers]
+    if procesos_mpi and shutil.which('mpirun') is None:
+        print("mpirun no está disponible, se omiten las corridas MPI")
+    elif procesos_mpi:
+        comandos += [('mpi', n, ['mpirun', '-n', str(n)] + shlex.split(argumentos_mpi) + [sys.executable, os.path.join(DIRECTORIO, 'generadorp.py')] + comunes)
+                     for n in procesos_mpi]
+
+    ejecuciones = []
+    for modo, procesos, comando in comandos:
+        salida = tempfile.mkdtemp(prefix='benchmark_')
+        try:
+            inicio = time.perf_counter()
+            subprocess.run(comando, cwd=salida, check=True, stdout=subprocess.DEVNULL)
+            ejecuciones.append({'modo': modo, 'procesos': procesos, 'segundos': time.perf_counter() - inicio})
+        finally:
+            shutil.rmtree(salida)
+    return ejecuciones
+
+def comparar(anterior, actual):
+    print("Comparación con la corrida anterior (%s):" % anterior.get('fecha'))
+    for nombre, segundos in actual['etapas'].items():
+        if nombre in anterior.get('etapas', {}):
+            print("  %-30s %9.3f -> %9.3f segundos (x%.2f)" % (nombre, anterior['etapas'][nombre], segundos, segundos / max(anterior['etapas'][nombre], 1e-9)))
+    previas = {(e['modo'], e['procesos']): e['segundos'] for e in anterior.get('ejecuciones', [])}
+    for ejecucion in actual['ejecuciones']:
+        clave = (ejecucion['modo'], ejecucion['procesos'])
+        if clave in previas:
+            print("  %-30s %9.3f -> %9.3f segundos (x%.2f)" % ('%s %d' % clave, previas[clave], ejecucion['segundos'], ejecucion['segundos'] / max(previas[clave], 1e-9)))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks del procesador de tweets')
+    parser.add_argument('prueba', nargs='?', choices=['etapas', 'menciones'], default='etapas',
+                        help='etapas: corpus sintético, tiempos por etapa y corridas completas; menciones: escalamiento del índice de menciones')
+    parser.add_argument('-n', '--menciones', type=int, nargs='+', default=[10000, 20000, 40000, 80000, 160000],
+                        help='Cantidades de menciones a un mismo usuario')
+    parser.add_argument('-dc', '--corpus', type=str, default='corpus_benchmark', help='Directorio del corpus sintético (se reutiliza si los parámetros no cambian)')
+    parser.add_argument('-t', '--tweets', type=int, default=100000, help='Tweets del corpus')
+    parser.add_argument('-a', '--archivos', type=int, default=8, help='Archivos .json.bz2 (uno por hora)')
+    parser.add_argument('-prt', '--proporcion_rt', type=float, default=0.5, help='Proporción de retweets')
+    parser.add_argument('-fm', '--fan_menciones', type=float, default=1.0, help='Menciones promedio por tweet original')
+    parser.add_argument('-u', '--usuarios', type=int, default=10000, help='Usuarios distintos')
+    parser.add_argument('-z', '--sesgo', type=float, default=1.1, help='Exponente de la ley de potencias de la popularidad de los usuarios')
+    parser.add_argument('-ph', '--proporcion_hashtags', type=float, default=0.3, help='Proporción de tweets con alguno de los hashtags filtrados')
+    parser.add_argument('-nh', '--num_hashtags', type=int, default=20, help='Hashtags en el archivo de filtro')
+    parser.add_argument('-s', '--semilla', type=int, default=0, help='Semilla del generador del corpus')
+    parser.add_argument('-fg', '--formato_grafo', choices=['gexf', 'graphml', 'aristas', 'csr'], default='gexf', help='Formato de los grafos medidos')
+    parser.add_argument('-w', '--workers', type=int, nargs='*', default=[1], help='Corridas completas de generador.py con estos -w/-wcrt')
+    parser.add_argument('-np', '--procesos_mpi', type=int, nargs='*', default=[], help='Corridas de generadorp.py con mpirun -n para cada cantidad')
+    parser.add_argument('-am', '--argumentos_mpi', type=str, default='', help='Argumentos extra para mpirun, por ejemplo "--oversubscribe"')
+    parser.add_argument('-o', '--salida', type=str, default='benchmark.json', help='Archivo donde se guardan los resultados')
+    parser.add_argument('-cmp', '--comparar', type=str, help='Resultados de una corrida anterior para comparar')
+    args = parser.parse_args()
+
+    if args.prueba == 'menciones':
+        print("Escalamiento de menciones (un destino, fuentes distintas):")
+        for resultado in benchmark_menciones(args.menciones):
+            print("  %8d menciones: %.4f segundos, %.3f us por mención" % (resultado['menciones'], resultado['segundos'], resultado['us_por_mencion']))
+        return
+
+    inicio = time.perf_counter()
+    parametros = generar_corpus(args.corpus, args.tweets, args.archivos, args.proporcion_rt, args.fan_menciones, args.usuarios,
+                                args.sesgo, args.proporcion_hashtags, args.num_hashtags, args.semilla)
+    print("Corpus listo en %.2f segundos (%s)" % (time.perf_counter() - inicio, args.corpus))
+
+    etapas, volumen = benchmark_etapas(args.corpus, parametros, args.formato_grafo)
+    print("Etapas (%d líneas, %d tweets filtrados):" % (volumen['lineas'], volumen['tweets_filtrados']))
+    for nombre, segundos in etapas.items():
+        print("  %-30s %9.3f segundos" % (nombre, segundos))
+    print("  descompresión: %.1f MB/s, filtro: %.0f líneas/s" % (volumen['bytes_descomprimidos'] / max(etapas['descompresion'], 1e-9) / 1e6,
+                                                                 volumen['lineas'] / max(etapas['filtro'], 1e-9)))
+
+    ejecuciones = benchmark_ejecuciones(args.corpus, parametros, args.workers, args.procesos_mpi, args.argumentos_mpi)
+    for ejecucion in ejecuciones:
+        print("  %-30s %9.3f segundos" % ('%s %d' % (ejecucion['modo'], ejecucion['procesos']), ejecucion['segundos']))
+
+    resultados = {'fecha': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                  'plataforma': platform.platform(), 'cpus': os.cpu_count(), 'corpus': parametros,
+                  'volumen': volumen, 'etapas': etapas, 'ejecuciones': ejecuciones}
+    if args.comparar is not None:
+        with open(args.comparar) as file:
+            comparar(json.load(file), resultados)
+    with open(args.salida, 'w') as file:
+        json.dump(resultados, file, indent=4)
+    print("Resultados guardados en", args.salida)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import os
+import bz2
+import mmap
+import time
+import queue
+import threading
+import multiprocessing
+import perfil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Marcas de 48 bits de bzip2: inicio de bloque y fin de flujo. Dentro del archivo no están
+# alineadas a bytes, cada bloque empieza en cualquier bit
+MARCA_BLOQUE = 0x314159265359
+MARCA_FIN = 0x177245385090
+TAM_LECTURA = 1 << 20
+
+# Pool de descompresión por proceso (la corrida o cada rank), creado al primer archivo con varios
+# bloques y reutilizado en los siguientes: crearlo por archivo cuesta más que descomprimir los
+# archivos pequeños de una hora o un minuto. Se cierra con el atexit de concurrent.futures
+pool = None
+pool_workers = pool_pid = None
+
+
+def leer_lineas(archivo_bz2, workers=1):
+    # Lecturas grandes partidas en líneas, en lugar de iterar el archivo línea por línea
+    if workers > 1:
+        trozos = leer_paralelo(archivo_bz2, workers)
+    else:
+        trozos = leer_secuencial(archivo_bz2)
+    yield from partir_lineas(trozos, 'descompresion')
+
+def partir_lineas(trozos, etapa):
+    resto = b''
+    trozos = iter(trozos)
+    while True:
+        # Se mide solo el tiempo de obtener cada trozo, no el de quien consume las líneas
+        inicio = time.perf_counter()
+        trozo = next(trozos, None)
+        if perfil.activo:
+            perfil.sumar_tiempo(etapa, time.perf_counter() - inicio)
+        if trozo is None:
+            break
+        lineas = (resto + trozo).split(b'\n')
+        resto = lineas.pop()
+        if perfil.activo:
+            perfil.contar('bytes_descomprimidos', len(trozo))
+            perfil.contar('lineas', len(lineas))
+        yield from lineas
+    if resto:
+        perfil.contar('lineas')
+        yield resto
+
+def leer_secuencial(archivo_bz2, omitir=0):
+    with bz2.BZ2File(archivo_bz2, 'rb') as f_in:
+        while True:
+            trozo = f_in.read(TAM_LECTURA)
+            if not trozo:
+                break
+            if omitir:
+                descartar = min(omitir, len(trozo))
+                trozo = trozo[descartar:]
+                omitir -= descartar
+            if trozo:
+                yield trozo
+
+def leer_lineas_solapado(archivos, profundidad_lectura=8, profundidad_descompresion=8):
+    # Tubería acotada de tres etapas: un hilo lee por adelantado los bytes comprimidos de los archivos
+    # siguientes, otro los descomprime (bz2 suelta el GIL mientras descomprime) y quien consume las
+    # líneas las filtra y agrega. Las colas con tope frenan a las etapas rápidas, así en memoria hay
+    # a lo sumo profundidad_lectura + profundidad_descompresion trozos de TAM_LECTURA.
+    # Entrega (archivo, líneas) en orden; las líneas de cada archivo se deben consumir antes de pedir el siguiente
+    comprimidos = queue.Queue(profundidad_lectura)
+    descomprimidos = queue.Queue(profundidad_descompresion)
+    cancelado = threading.Event()
+    hilos = [threading.Thread(target=leer_comprimidos, args=(archivos, comprimidos, cancelado), daemon=True),
+             threading.Thread(target=descomprimir_cola, args=(len(archivos), comprimidos, descomprimidos, cancelado), daemon=True)]
+    for hilo in hilos:
+        hilo.start()
+
+    try:
+        for archivo in archivos:
+            lineas = partir_lineas(recibir(descomprimidos, cancelado), 'espera_descompresion')
+            yield archivo, lineas
+            # Si quien consume no terminó el archivo, se descarta el resto para no mezclarlo con el siguiente
+            for _ in lineas:
+                pass
+    finally:
+        cancelado.set()
+        for hilo in hilos:
+            hilo.join()
+
+def poner(cola, elemento, cancelado):
+    while not cancelado.is_set():
+        try:
+            cola.put(elemento, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def recibir(cola, cancelado):
+    # Elementos de un archivo hasta su marca de fin (None); el error de una etapa anterior se relanza aquí
+    while not cancelado.is_set():
+        try:
+            elemento = cola.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if elemento is None:
+            return
+        if isinstance(elemento, Exception):
+            raise elemento
+        yield elemento
+
+def leer_comprimidos(archivos, salida, cancelado):
+    try:
+        for archivo in archivos:
+            with open(archivo, 'rb') as f_in:
+                while True:
+                    inicio = time.perf_counter()
+                    trozo = f_in.read(TAM_LECTURA)
+                    if perfil.activo:
+                        perfil.sumar_tiempo('lectura_disco', time.perf_counter() - inicio)
+                    if not trozo:
+                        break
+                    if not poner(salida, trozo, cancelado):
+                        return
+            if not poner(salida, None, cancelado):
+                return
+    except Exception as error:
+        poner(salida, error, cancelado)
+
+def descomprimir_cola(num_archivos, entrada, salida, cancelado):
+    try:
+        for _ in range(num_archivos):
+            trozos = recibir(entrada, cancelado)
+            for trozo in descomprimir_trozos(trozos):
+                if not poner(salida, trozo, cancelado):
+                    return
+            # Con basura al final, descomprimir_trozos termina antes: el resto del archivo, hasta su
+            # marca de fin, se descarta aquí para no tomarlo como el comienzo del siguiente
+            for _ in trozos:
+                pass
+            if not poner(salida, None, cancelado):
+                return
+    except Exception as error:
+        poner(salida, error, cancelado)
+
+def descomprimir_trozos(trozos):
+    # Igual que BZ2File: varios flujos concatenados (pbzip2) se leen seguidos y se ignora la basura al final
+    descompresor = None
+    flujos = 0
+    for datos in trozos:
+        while datos:
+            inicio = time.perf_counter()
+            if descompresor is None:
+                descompresor = bz2.BZ2Decompressor()
+                try:
+                    salida = descompresor.decompress(datos, TAM_LECTURA)
+                except OSError:
+                    if flujos == 0:
+                        raise
+                    return
+            else:
+                salida = descompresor.decompress(datos, TAM_LECTURA)
+            datos = b''
+            while True:
+                if perfil.activo:
+                    perfil.sumar_tiempo('descompresion', time.perf_counter() - inicio)
+                if salida:
+                    yield salida
+                if descompresor.eof or descompresor.needs_input:
+                    break
+                inicio = time.perf_counter()
+                salida = descompresor.decompress(b'', TAM_LECTURA)
+            if descompresor.eof:
+                datos = descompresor.unused_data
+                descompresor = None
+                flujos += 1
+    if descompresor is not None:
+        raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+def leer_paralelo(archivo_bz2, workers):
+    entregados = 0
+    try:
+        for trozo in descomprimir_bloques(archivo_bz2, workers):
+            entregados += len(trozo)
+            yield trozo
+        return
+    except (OSError, ValueError, EOFError):
+        pass
+
+    # Una marca falsa dentro de los datos comprimidos deja un bloque imposible de reconstruir:
+    # se sigue con la lectura secuencial desde donde se quedó
+    yield from leer_secuencial(archivo_bz2, entregados)
+
+def leer_bits(datos, inicio, cantidad):
+    primero, ultimo = inicio // 8, (inicio + cantidad + 7) // 8
+    valor = int.from_bytes(datos[primero:ultimo], 'big')
+    return (valor >> ((ultimo - primero) * 8 - (inicio - primero * 8) - cantidad)) & ((1 << cantidad) - 1)
+
+def buscar_marca(datos, marca):
+    # Para cada uno de los 8 corrimientos posibles, los bytes 1..5 de la marca corrida quedan
+    # completos y se pueden buscar con find; cada candidato se verifica bit a bit
+    posiciones = []
+    for corrimiento in range(8):
+        patron = (marca << (8 - corrimiento)).to_bytes(7, 'big')[1:6]
+        encontrado = datos.find(patron)
+        while encontrado != -1:
+            bit = (encontrado - 1) * 8 + corrimiento
+            if bit >= 0 and leer_bits(datos, bit, 48) == marca:
+                posiciones.append(bit)
+            encontrado = datos.find(patron, encontrado + 1)
+    return sorted(posiciones)
+
+def descomprimir_bloque(trozo, inicio, largo):
+    # Reconstruye un flujo bzip2 con un solo bloque: cabecera, el bloque realineado a bytes
+    # y la marca de fin con el CRC del flujo, que con un bloque es el CRC del propio bloque
+    valor = int.from_bytes(trozo, 'big')
+    bloque = (valor >> (len(trozo) * 8 - inicio - largo)) & ((1 << largo) - 1)
+    crc = (bloque >> (largo - 80)) & 0xffffffff
+    flujo = (bloque << 80) | (MARCA_FIN << 32) | crc
+    bits = largo + 80
+    relleno = -bits % 8
+    return bz2.decompress(b'BZh9' + (flujo << relleno).to_bytes((bits + relleno) // 8, 'big'))
+
+def obtener_pool(workers):
+    global pool, pool_workers, pool_pid
+    # Un proceso hijo creado con fork hereda la variable pero no los procesos del pool
+    if pool is None or pool_workers != workers or pool_pid != os.getpid():
+        if pool is not None and pool_pid == os.getpid():
+            pool.shutdown()
+        pool, pool_workers, pool_pid = ProcessPoolExecutor(workers), workers, os.getpid()
+    return pool
+
+def descomprimir_bloques(archivo_bz2, workers):
+    with open(archivo_bz2, 'rb') as f_in:
+        if f_in.seek(0, 2) == 0:
+            return
+        with mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as datos:
+            # Cada bloque termina donde empieza el siguiente o donde termina su flujo
+            # (los archivos de pbzip2 son varios flujos concatenados)
+            marcas = sorted([(bit, True) for bit in buscar_marca(datos, MARCA_BLOQUE)] +
+                            [(bit, False) for bit in buscar_marca(datos, MARCA_FIN)])
+            if marcas and marcas[-1][1]:
+                raise EOFError("Flujo bzip2 sin marca de fin")
+            bloques = [(inicio, fin) for (inicio, es_bloque), (fin, _) in zip(marcas, marcas[1:]) if es_bloque]
+
+            # Con un solo bloque no hay nada que repartir
+            if len(bloques) <= 1:
+                for inicio, fin in bloques:
+                    yield descomprimir_bloque(datos[inicio // 8:(fin + 7) // 8], inicio % 8, fin - inicio)
+                return
+
+            # Dentro de un proceso de -w no corren los atexit que cerrarían el pool compartido y el proceso
+            # no podría terminar: ahí se usa un pool propio del archivo, que se cierra al terminarlo
+            compartido = multiprocessing.parent_process() is None
+            executor = obtener_pool(workers) if compartido else ProcessPoolExecutor(workers)
+            # Ventana acotada de bloques en vuelo para no cargar el archivo completo en memoria
+            pendientes = deque()
+            try:
+                for inicio, fin in bloques:
+                    trozo = datos[inicio // 8:(fin + 7) // 8]
+                    pendientes.append(executor.submit(descomprimir_bloque, trozo, inicio % 8, fin - inicio))
+                    if len(pendientes) >= 2 * workers:
+                        yield pendientes.popleft().result()
+                while pendientes:
+                    yield pendientes.popleft().result()
+            finally:
+                # Si se deja el archivo a medias, lo que no empezó no ocupa el pool compartido
+                for pendiente in pendientes:
+                    pendiente.cancel()
+                if not compartido:
+                    executor.shutdown()
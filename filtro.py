@@ -0,0 +1,130 @@
+import re
+
+# Filtro de tweets compilado una sola vez al inicio: hashtags exactos, prefijos (línea "prefijo*") y
+# expresiones regulares (línea "re:expresión") del archivo -h, más listas de usuarios permitidos o
+# excluidos. Hashtags y usuarios se comparan en minúsculas
+PREFIJO_REGEX = 're:'
+FIN = -1
+
+
+class Filtro:
+    __slots__ = ('exactos', 'prefijos', 'largos_prefijo', 'patrones', 'patron', 'permitidos', 'excluidos', 'prefiltros')
+
+    def __init__(self, hashtags=None, permitidos=None, excluidos=None):
+        # Sin hashtags (None) no se filtra por hashtags; con una lista, el tweet debe tener al menos uno que calce
+        self.exactos = self.prefijos = self.patron = None
+        self.largos_prefijo = ()
+        self.patrones = []
+        if hashtags is not None:
+            self.exactos, self.prefijos = set(), set()
+            for linea in hashtags:
+                if linea.startswith(PREFIJO_REGEX):
+                    self.patrones.append(linea[len(PREFIJO_REGEX):])
+                elif linea.endswith('*'):
+                    self.prefijos.add(linea[:-1].lower())
+                elif linea:
+                    self.exactos.add(linea.lower())
+            # Los prefijos se buscan cortando el hashtag a cada largo distinto, no probando uno por uno
+            self.largos_prefijo = sorted(set(len(prefijo) for prefijo in self.prefijos))
+            if self.patrones:
+                for patron in self.patrones:
+                    try:
+                        re.compile(patron)
+                    except re.error as error:
+                        raise ValueError("Expresión regular inválida en el archivo de hashtags: %s (%s)" % (patron, error))
+                self.patron = re.compile('|'.join('(?:%s)' % patron for patron in self.patrones), re.IGNORECASE)
+
+        self.permitidos = set(nombre.lower() for nombre in permitidos) if permitidos is not None else None
+        self.excluidos = set(nombre.lower() for nombre in excluidos) if excluidos is not None else None
+
+        # Descartes sobre los bytes crudos de la línea, antes de json.loads: el tweet debe contener
+        # algún fragmento de los hashtags buscados y, con lista de permitidos, alguno de sus nombres
+        self.prefiltros = []
+        if self.exactos is not None and not self.patrones:
+            self.prefiltros.append(compilar_prefiltro(self.exactos | self.prefijos))
+        if self.permitidos is not None:
+            self.prefiltros.append(compilar_prefiltro(self.permitidos))
+        self.prefiltros = tuple(prefiltro for prefiltro in self.prefiltros if prefiltro is not None)
+
+    def con_hashtags(self):
+        return self.exactos is not None
+
+    def con_usuarios(self):
+        return self.permitidos is not None or self.excluidos is not None
+
+    def acepta_hashtag(self, texto):
+        # texto ya en minúsculas
+        if texto in self.exactos:
+            return True
+        for largo in self.largos_prefijo:
+            if texto[:largo] in self.prefijos:
+                return True
+        return self.patron is not None and self.patron.fullmatch(texto) is not None
+
+    def acepta_usuario(self, nombre):
+        nombre = nombre.lower()
+        return (self.permitidos is None or nombre in self.permitidos) and (self.excluidos is None or nombre not in self.excluidos)
+
+    def acepta(self, tweet):
+        # tweet es el diccionario decodificado; los usuarios se comparan con el autor (quien retuitea, en un retweet)
+        if self.con_usuarios() and not self.acepta_usuario(tweet['user']['screen_name']):
+            return False
+        if self.exactos is None:
+            return True
+        for hashtag in tweet['entities']['hashtags']:
+            if self.acepta_hashtag(hashtag['text'].lower()):
+                return True
+        return False
+
+    def clave(self):
+        # Forma canónica para compararlo con los filtros de un estado incremental guardado
+        ordenar = lambda conjunto: sorted(conjunto) if conjunto is not None else None
+        return {'hashtags': ordenar(self.exactos), 'prefijos': ordenar(self.prefijos), 'patrones': self.patrones,
+                'permitidos': ordenar(self.permitidos), 'excluidos': ordenar(self.excluidos)}
+
+def compilar_prefiltro(textos):
+    # Para textos con otros caracteres se busca su tramo alfanumérico ASCII más largo, ya que
+    # el JSON puede traerlos escapados (\u00f1) o con otra capitalización
+    fragmentos = set()
+    for texto in textos:
+        fragmento = max(re.findall(r'[0-9A-Za-z_]*', texto), key=len)
+        if not fragmento:
+            return None
+        fragmentos.add(fragmento.lower().encode('ascii'))
+    if not fragmentos:
+        return None
+    return re.compile(compilar_trie(fragmentos), re.IGNORECASE)
+
+def compilar_trie(fragmentos):
+    # Los fragmentos se factorizan por prefijo común en una sola expresión, así el motor de re elige la
+    # rama por el siguiente byte en lugar de probar miles de alternativas en cada posición de la línea.
+    # Si un fragmento contiene como prefijo a otro, basta con buscar el más corto
+    trie = {}
+    for fragmento in fragmentos:
+        nodo = trie
+        for byte in fragmento:
+            if FIN in nodo:
+                break
+            nodo = nodo.setdefault(byte, {})
+        else:
+            nodo.clear()
+            nodo[FIN] = True
+    return armar_trie(trie)
+
+def armar_trie(nodo):
+    if FIN in nodo:
+        return b''
+    ramas = [re.escape(bytes([byte])) + armar_trie(hijo) for byte, hijo in sorted(nodo.items())]
+    return ramas[0] if len(ramas) == 1 else b'(?:' + b'|'.join(ramas) + b')'
+
+def leer_lista(archivo):
+    with open(archivo, 'r') as file:
+        return [line.strip() for line in file if line.strip()]
+
+def leer_filtro(archivo_hashtags=None, archivo_permitidos=None, archivo_excluidos=None):
+    # None si no se pidió ningún filtro. Los usuarios pueden venir con o sin @
+    if archivo_hashtags is None and archivo_permitidos is None and archivo_excluidos is None:
+        return None
+    usuarios = lambda archivo: [nombre.lstrip('@') for nombre in leer_lista(archivo)] if archivo is not None else None
+    return Filtro(leer_lista(archivo_hashtags) if archivo_hashtags is not None else None,
+                  usuarios(archivo_permitidos), usuarios(archivo_excluidos))
@@ -1,213 +1,846 @@
 import os
 import json
-import bz2
 import sys
+import mmap
+import struct
+import marshal
+import hashlib
+import pickle
 import time
-import networkx as nx
-from datetime import datetime
+import heapq
+from array import array
+from datetime import datetime, timedelta
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
 import argparse
-
-
-def procesar_tweets(archivo_bz2, fecha_inicial=None, fecha_final=None, hashtags=None):
-    tweets = []
-
-    with bz2.BZ2File(archivo_bz2, 'rb') as f_in:
-        for line in f_in:
-            tweet_data = json.loads(line.decode('utf-8'))
-
+from bz2paralelo import leer_lineas, leer_lineas_solapado
+from filtro import leer_filtro
+import perfil
+from grafos import Aristas, BITS_NODO, MASCARA_NODO, desde_contador, exportar_grafo
+
+
+MESES = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+         'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+
+# Los tweets del stream empiezan con la fecha, así se puede leer sin decodificar el JSON
+PREFIJO_FECHA = b'{"created_at":"'
+
+def parsear_fecha(created_at):
+    # Formato fijo 'Wed Oct 10 20:19:24 +0000 2018': se lee por posiciones, mucho más rápido que strptime
+    if len(created_at) == 30 and created_at[19:26] == ' +0000 ' and created_at[4:7] in MESES:
+        try:
+            return datetime(int(created_at[26:30]), MESES[created_at[4:7]], int(created_at[8:10]),
+                            int(created_at[11:13]), int(created_at[14:16]), int(created_at[17:19]))
+        except ValueError:
+            pass
+    return datetime.strptime(created_at, '%a %b %d %H:%M:%S +0000 %Y')
+
+def en_rango(created_at, fecha_inicial=None, fecha_final=None):
+    return (fecha_inicial is None or created_at >= fecha_inicial) and (fecha_final is None or created_at <= fecha_final)
+
+def procesar_tweets(archivo_bz2, fecha_inicial=None, fecha_final=None, filtro=None, rango=None, workers_bz2=1):
+    # Generador: cada tweet se decodifica una sola vez y se entrega a quien lo consuma.
+    # Si se pasa rango, al terminar el archivo queda con la fecha mínima y máxima de sus tweets
+    yield from filtrar_lineas(leer_lineas(archivo_bz2, workers_bz2), fecha_inicial, fecha_final, filtro, rango)
+
+def filtrar_lineas(lineas, fecha_inicial=None, fecha_final=None, filtro=None, rango=None):
+    # Filtro y proyección sobre líneas ya descomprimidas, separado de la lectura del archivo.
+    # filtro es un Filtro de filtro.py (hashtags y usuarios) compilado una sola vez, o None
+    prefiltros = filtro.prefiltros if filtro is not None else ()
+    filtrar_fechas = fecha_inicial is not None or fecha_final is not None
+    fecha_minima = fecha_maxima = None
+
+    for line in lineas:
+        # Descartes rápidos antes de decodificar el JSON completo
+        fecha = None
+        if (filtrar_fechas or rango is not None) and line.startswith(PREFIJO_FECHA):
+            try:
+                fecha = parsear_fecha(line[15:45].decode('ascii'))
+            except ValueError:
+                pass
+        if rango is not None and fecha is None and b'"created_at"' in line:
+            tweet_data = json.loads(line)
             if 'created_at' in tweet_data:
-                created_at = datetime.strptime(tweet_data['created_at'], '%a %b %d %H:%M:%S +0000 %Y')
-
-                # Verifica si el tweet está dentro del rango de fechas
-                if (fecha_inicial is None or created_at >= fecha_inicial) and (fecha_final is None or created_at <= fecha_final):
-                    # Verifica si el tweet contiene al menos uno de los hashtags especificados
-                    if hashtags is None or tiene_hashtags(tweet_data, hashtags):
-                        tweets.append(tweet_data)
-
+                fecha = parsear_fecha(tweet_data['created_at'])
+        if rango is not None and fecha is not None:
+            if fecha_minima is None or fecha < fecha_minima:
+                fecha_minima = fecha
+            if fecha_maxima is None or fecha > fecha_maxima:
+                fecha_maxima = fecha
+
+        if fecha is not None and not en_rango(fecha, fecha_inicial, fecha_final):
+            continue
+        if prefiltros and not all(prefiltro.search(line) for prefiltro in prefiltros):
+            continue
+
+        tweet_data = json.loads(line)
+
+        if 'created_at' in tweet_data:
+            created_at = parsear_fecha(tweet_data['created_at'])
+
+            # Verifica si el tweet está dentro del rango de fechas
+            if en_rango(created_at, fecha_inicial, fecha_final):
+                # Verifica si el tweet contiene al menos uno de los hashtags especificados y si su autor está permitido
+                if filtro is None or filtro.acepta(tweet_data):
+                    yield proyectar_tweet(tweet_data, created_at)
+
+    if rango is not None:
+        rango['min'], rango['max'] = fecha_minima, fecha_maxima
+
+class Tweet:
+    # Proyección compacta de un tweet: solo los campos que leen los análisis, sin diccionario por instancia
+    __slots__ = ('screen_name', 'id_str', 'created_at', 'user_mentions', 'retweeted_status')
+
+    def __init__(self, screen_name, id_str, created_at=None, user_mentions=(), retweeted_status=None):
+        self.screen_name = screen_name
+        self.id_str = id_str
+        self.created_at = created_at
+        self.user_mentions = user_mentions
+        self.retweeted_status = retweeted_status
+
+def proyectar_tweet(tweet_data, created_at=None):
+    # Los screen_name no se internan aquí: los agregadores los guardan una sola vez en la tabla de usuarios
+    retweeted_status = None
+    if 'retweeted_status' in tweet_data:
+        retweeted_status = proyectar_tweet(tweet_data['retweeted_status'])
+    return Tweet(tweet_data['user']['screen_name'],
+                 tweet_data['id_str'],
+                 created_at,
+                 tuple(mention['screen_name'] for mention in tweet_data['entities']['user_mentions']),
+                 retweeted_status)
+
+# Caché en disco de los tweets proyectados, un archivo por cada .json.bz2 de entrada.
+# Guarda todos los tweets con fecha (sin filtrar) en columnas, así sirve para cualquier -fi/-ff/-h.
+# Formato: MAGIA_CACHE, largo de la cabecera, cabecera (marshal) y las columnas alineadas a 8 bytes.
+# Las columnas de enteros van como bytes crudos del array y se leen en el lugar sobre el mmap; las de
+# strings van en marshal. La versión de Python forma parte de la magia porque marshal y los tamaños
+# de los arrays pueden cambiar entre versiones
+MAGIA_CACHE = b'TWCACHE2' + bytes(sys.version_info[:2])
+EPOCA = datetime(1970, 1, 1)
+
+def ruta_cache(directorio_cache, archivo_bz2):
+    nombre = hashlib.sha1(os.path.abspath(archivo_bz2).encode('utf-8')).hexdigest()
+    return os.path.join(directorio_cache, nombre + '.cache')
+
+def clave_cache(archivo_bz2):
+    estado = os.stat(archivo_bz2)
+    return {'archivo': os.path.abspath(archivo_bz2), 'tam': estado.st_size, 'mtime': estado.st_mtime_ns}
+
+def construir_columnas(archivo_bz2, workers_bz2=1):
+    cadenas = {}
+    columnas = {'fechas': array('q'), 'usuarios': array('l'), 'ids': [], 'retweets': array('l'),
+                'menciones': array('l'), 'fin_menciones': array('l'),
+                'hashtags': array('l'), 'fin_hashtags': array('l'),
+                'rt_usuarios': array('l'), 'rt_ids': [], 'rt_menciones': array('l'), 'rt_fin_menciones': array('l')}
+
+    def id_cadena(cadena):
+        indice = cadenas.get(cadena)
+        if indice is None:
+            indice = cadenas[cadena] = len(cadenas)
+        return indice
+
+    for line in leer_lineas(archivo_bz2, workers_bz2):
+        tweet_data = json.loads(line)
+        if 'created_at' not in tweet_data:
+            continue
+
+        tweet = proyectar_tweet(tweet_data)
+        columnas['fechas'].append(int((parsear_fecha(tweet_data['created_at']) - EPOCA).total_seconds()))
+        columnas['usuarios'].append(id_cadena(tweet.screen_name))
+        columnas['ids'].append(tweet.id_str)
+        columnas['menciones'].extend(id_cadena(mention) for mention in tweet.user_mentions)
+        columnas['fin_menciones'].append(len(columnas['menciones']))
+        columnas['hashtags'].extend(id_cadena(hashtag['text'].lower()) for hashtag in tweet_data['entities']['hashtags'])
+        columnas['fin_hashtags'].append(len(columnas['hashtags']))
+
+        # Los retweets apuntan a una fila de las columnas rt_*, -1 si no es retweet
+        if tweet.retweeted_status is None:
+            columnas['retweets'].append(-1)
+        else:
+            columnas['retweets'].append(len(columnas['rt_ids']))
+            columnas['rt_usuarios'].append(id_cadena(tweet.retweeted_status.screen_name))
+            columnas['rt_ids'].append(tweet.retweeted_status.id_str)
+            columnas['rt_menciones'].extend(id_cadena(mention) for mention in tweet.retweeted_status.user_mentions)
+            columnas['rt_fin_menciones'].append(len(columnas['rt_menciones']))
+
+    columnas['cadenas'] = list(cadenas)
+    return columnas
+
+def guardar_cache(directorio_cache, archivo_bz2, columnas):
+    os.makedirs(directorio_cache, exist_ok=True)
+    # La cabecera guarda, por columna, su tipo (el typecode del array o None si va en marshal) y su
+    # posición relativa al inicio de los datos
+    bloques, disposicion, posicion = [], {}, 0
+    for nombre, columna in columnas.items():
+        datos = columna.tobytes() if isinstance(columna, array) else marshal.dumps(columna)
+        relleno = -posicion % 8
+        bloques.append(bytes(relleno) + datos)
+        disposicion[nombre] = (columna.typecode if isinstance(columna, array) else None, posicion + relleno, len(datos))
+        posicion += relleno + len(datos)
+    cabecera = marshal.dumps({'clave': clave_cache(archivo_bz2), 'columnas': disposicion})
+    inicio = len(MAGIA_CACHE) + 8 + len(cabecera)
+
+    # Se escribe en un temporal y se renombra para no dejar entradas a medias
+    ruta = ruta_cache(directorio_cache, archivo_bz2)
+    temporal = '%s.%d.tmp' % (ruta, os.getpid())
+    with open(temporal, 'wb') as f_out:
+        f_out.write(MAGIA_CACHE + struct.pack('<Q', len(cabecera)))
+        f_out.write(cabecera)
+        f_out.write(bytes(-inicio % 8))
+        f_out.writelines(bloques)
+    os.replace(temporal, ruta)
+
+def leer_cabecera_cache(f_in):
+    # Devuelve la cabecera y el inicio de los datos, o (None, 0) si no es una entrada de esta versión
+    inicio = f_in.read(len(MAGIA_CACHE) + 8)
+    if len(inicio) < len(MAGIA_CACHE) + 8 or inicio[:len(MAGIA_CACHE)] != MAGIA_CACHE:
+        return None, 0
+    largo = struct.unpack('<Q', inicio[len(MAGIA_CACHE):])[0]
+    try:
+        cabecera = marshal.loads(f_in.read(largo))
+    except (EOFError, ValueError, TypeError):
+        return None, 0
+    inicio = len(MAGIA_CACHE) + 8 + largo
+    return cabecera, inicio + -inicio % 8
+
+def cargar_cache(directorio_cache, archivo_bz2):
+    ruta = ruta_cache(directorio_cache, archivo_bz2)
+    if not os.path.exists(ruta):
+        return None
+
+    with open(ruta, 'rb') as f_in:
+        cabecera, inicio = leer_cabecera_cache(f_in)
+        # La entrada solo vale si el archivo de origen no cambió de tamaño ni de fecha
+        if cabecera is None or cabecera['clave'] != clave_cache(archivo_bz2):
+            return None
+        mapa = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # Las columnas de enteros quedan como memoryview sobre el mapa, sin copiarlas; el mapa se
+    # libera cuando dejan de usarse
+    vista = memoryview(mapa)
+    columnas = {}
+    for nombre, (tipo, posicion, largo) in cabecera['columnas'].items():
+        datos = vista[inicio + posicion:inicio + posicion + largo]
+        columnas[nombre] = datos.cast(tipo) if tipo is not None else marshal.loads(datos)
+    return columnas
+
+def limpiar_cache(directorio_cache):
+    # Borra las entradas de otra versión y aquellas cuyo archivo de origen ya no existe o fue modificado
+    eliminadas = 0
+    if not os.path.isdir(directorio_cache):
+        return eliminadas
+    for nombre in os.listdir(directorio_cache):
+        ruta = os.path.join(directorio_cache, nombre)
+        if not nombre.endswith('.cache'):
+            continue
+        with open(ruta, 'rb') as f_in:
+            cabecera, _ = leer_cabecera_cache(f_in)
+        clave = cabecera['clave'] if cabecera is not None else None
+        if clave is None or not os.path.exists(clave['archivo']) or clave != clave_cache(clave['archivo']):
+            os.remove(ruta)
+            eliminadas += 1
+    return eliminadas
+
+def filtrar_columnas(columnas, fecha_inicial=None, fecha_final=None, filtro=None):
+    cadenas = columnas['cadenas']
+    desde = int((fecha_inicial - EPOCA).total_seconds()) if fecha_inicial is not None else None
+    hasta = int((fecha_final - EPOCA).total_seconds()) if fecha_final is not None else None
+
+    # Los hashtags y usuarios aceptados se traducen una vez a los ids de la tabla de cadenas del archivo
+    buscados = usuarios = None
+    if filtro is not None and filtro.con_hashtags():
+        buscados = set(i for i, cadena in enumerate(cadenas) if filtro.acepta_hashtag(cadena))
+    if filtro is not None and filtro.con_usuarios():
+        usuarios = set(i for i, cadena in enumerate(cadenas) if filtro.acepta_usuario(cadena))
+
+    fechas, fin_menciones, fin_hashtags = columnas['fechas'], columnas['fin_menciones'], columnas['fin_hashtags']
+    inicio_menciones = inicio_hashtags = 0
+    for fila, fecha in enumerate(fechas):
+        inicio_m, inicio_menciones = inicio_menciones, fin_menciones[fila]
+        inicio_h, inicio_hashtags = inicio_hashtags, fin_hashtags[fila]
+
+        if (desde is not None and fecha < desde) or (hasta is not None and fecha > hasta):
+            continue
+        if usuarios is not None and columnas['usuarios'][fila] not in usuarios:
+            continue
+        if buscados is not None and buscados.isdisjoint(columnas['hashtags'][inicio_h:inicio_hashtags]):
+            continue
+
+        retweeted_status = None
+        rt = columnas['retweets'][fila]
+        if rt >= 0:
+            rt_inicio = columnas['rt_fin_menciones'][rt - 1] if rt > 0 else 0
+            retweeted_status = Tweet(cadenas[columnas['rt_usuarios'][rt]], columnas['rt_ids'][rt], None,
+                                     tuple(cadenas[i] for i in columnas['rt_menciones'][rt_inicio:columnas['rt_fin_menciones'][rt]]))
+        yield Tweet(cadenas[columnas['usuarios'][fila]], columnas['ids'][fila], EPOCA + timedelta(seconds=fecha),
+                    tuple(cadenas[i] for i in columnas['menciones'][inicio_m:inicio_menciones]), retweeted_status)
+
+def leer_tweets(archivo_bz2, fecha_inicial=None, fecha_final=None, filtro=None, directorio_cache=None, rango=None, workers_bz2=1):
+    if directorio_cache is None:
+        return procesar_tweets(archivo_bz2, fecha_inicial, fecha_final, filtro, rango, workers_bz2)
+
+    # Con caché se decodifica el archivo completo una sola vez y los filtros se aplican sobre las columnas
+    columnas = cargar_cache(directorio_cache, archivo_bz2)
+    if columnas is None:
+        columnas = construir_columnas(archivo_bz2, workers_bz2)
+        guardar_cache(directorio_cache, archivo_bz2, columnas)
+    if rango is not None:
+        fechas = columnas['fechas']
+        rango['min'] = EPOCA + timedelta(seconds=min(fechas)) if fechas else None
+        rango['max'] = EPOCA + timedelta(seconds=max(fechas)) if fechas else None
+    return filtrar_columnas(columnas, fecha_inicial, fecha_final, filtro)
+
+# Índice de fechas: para cada archivo, la fecha mínima y máxima de sus tweets. Se llena al leer
+# cada archivo por primera vez y permite saltar sin abrirlos los que quedan fuera de -fi/-ff
+def cargar_indice(archivo_indice):
+    if not os.path.exists(archivo_indice):
+        return {}
+    with open(archivo_indice, 'r') as file:
+        return json.load(file)
+
+def guardar_indice(archivo_indice, indice):
+    temporal = '%s.%d.tmp' % (archivo_indice, os.getpid())
+    with open(temporal, 'w') as file:
+        json.dump(indice, file, indent=1)
+    os.replace(temporal, archivo_indice)
+
+def registrar_rango(indice, archivo_bz2, rango):
+    entrada = clave_cache(archivo_bz2)
+    entrada['min'] = int((rango['min'] - EPOCA).total_seconds()) if rango['min'] is not None else None
+    entrada['max'] = int((rango['max'] - EPOCA).total_seconds()) if rango['max'] is not None else None
+    indice[entrada.pop('archivo')] = entrada
+
+def rango_indexado(indice, archivo_bz2):
+    entrada = indice.get(os.path.abspath(archivo_bz2))
+    if entrada is None:
+        return None
+    clave = clave_cache(archivo_bz2)
+    if entrada['tam'] != clave['tam'] or entrada['mtime'] != clave['mtime']:
+        return None
+    if entrada['min'] is None:
+        return (None, None)
+    return (EPOCA + timedelta(seconds=entrada['min']), EPOCA + timedelta(seconds=entrada['max']))
+
+# Holgura para los rangos deducidos de la ruta, un tweet puede guardarse en la carpeta de la hora siguiente
+MARGEN_RUTA = timedelta(hours=1)
+
+def rango_por_ruta(directorio, archivo_bz2):
+    # Estructura año/mes/día/hora/minuto, por ejemplo 2016/09/30/23/15.json.bz2 o 2016/09/30/23.json.bz2
+    partes = os.path.relpath(archivo_bz2, directorio)[:-len('.json.bz2')].split(os.sep)
+    if not 1 <= len(partes) <= 5 or not all(parte.isdigit() for parte in partes) or len(partes[0]) != 4:
+        return None
+    numeros = [int(parte) for parte in partes]
+    # En los extremos del calendario (año 1 o 9999) el rango con su margen no es representable
+    try:
+        inicio = datetime(*(numeros + [1, 1][len(numeros) - 1:]))
+        if len(numeros) == 1:
+            fin = inicio.replace(year=inicio.year + 1)
+        elif len(numeros) == 2:
+            fin = inicio.replace(year=inicio.year + inicio.month // 12, month=inicio.month % 12 + 1)
+        else:
+            fin = inicio + [timedelta(days=1), timedelta(hours=1), timedelta(minutes=1)][len(numeros) - 3]
+        return (inicio - MARGEN_RUTA, fin + MARGEN_RUTA)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+def debe_leerse(archivo_bz2, directorio, fecha_inicial=None, fecha_final=None, indice=None, fechas_por_ruta=False):
+    if fecha_inicial is None and fecha_final is None:
+        return True
+    rango = None
+    if indice is not None:
+        rango = rango_indexado(indice, archivo_bz2)
+    if rango is None and fechas_por_ruta:
+        rango = rango_por_ruta(directorio, archivo_bz2)
+    if rango is None:
+        return True
+    if rango[0] is None:
+        # Archivo sin tweets con fecha
+        return False
+    return (fecha_final is None or rango[0] <= fecha_final) and (fecha_inicial is None or rango[1] >= fecha_inicial)
+
+def agregar_archivo(agregados, archivo_bz2, fecha_inicial=None, fecha_final=None, filtro=None, directorio_cache=None, rango=None, workers_bz2=1,
+                    lineas=None):
+    # Cada tweet pasa por todos los agregadores y se descarta, no se guarda la lista completa.
+    # Con lineas, el archivo ya viene descomprimido desde la tubería de lectura
+    if lineas is not None:
+        tweets_archivo = filtrar_lineas(lineas, fecha_inicial, fecha_final, filtro, rango)
+    else:
+        tweets_archivo = leer_tweets(archivo_bz2, fecha_inicial, fecha_final, filtro, directorio_cache, rango, workers_bz2)
+    tweets = 0
+    for tweet in tweets_archivo:
+        agregar_tweet(agregados, tweet)
+        tweets += 1
+    perfil.contar('tweets', tweets)
+    perfil.contar('archivos')
+    perfil.contar('bytes_comprimidos', os.path.getsize(archivo_bz2))
     return tweets
 
-def tiene_hashtags(tweet, hashtags):
-    tweet_hashtags = set(hashtag['text'].lower() for hashtag in tweet['entities']['hashtags'])
-    return bool(hashtags.intersection(tweet_hashtags))
-
-def procesar_directorio(directorio, fecha_inicial=None, fecha_final=None, archivo_hashtags=None):
+def procesar_archivo(archivo_bz2, tipos, fecha_inicial=None, fecha_final=None, filtro=None, directorio_cache=None, con_rango=False, workers_bz2=1):
+    # Agregados parciales de un solo archivo, usado por los procesos del pool
+    agregados = crear_agregados(**dict.fromkeys(tipos, True))
+    rango = {} if con_rango else None
+    agregar_archivo(agregados, archivo_bz2, fecha_inicial, fecha_final, filtro, directorio_cache, rango, workers_bz2)
+    return agregados, rango
+
+def procesar_archivo_medido(*args):
+    # Igual que procesar_archivo, pero devuelve también lo medido en el proceso del pool
+    perfil.reiniciar()
+    with perfil.etapa('lectura'):
+        resultado = procesar_archivo(*args)
+    return resultado, perfil.parcial()
+
+def procesar_directorio(directorio, agregados, fecha_inicial=None, fecha_final=None, filtro=None, workers=1, directorio_cache=None,
+                        archivo_indice=None, fechas_por_ruta=False, procesados=None, workers_bz2=1, tuberia=None):
     num_tweets_comprimidos = 0
-    tweets = []
 
-    hashtags = None
-    if archivo_hashtags is not None:
-        with open(archivo_hashtags, 'r') as file:
-            hashtags = set(line.strip().lower() for line in file)
+    indice = cargar_indice(archivo_indice) if archivo_indice is not None else None
 
+    archivos = []
     for root, _, files in os.walk(directorio):
         for archivo in files:
             if archivo.endswith('.json.bz2'):
-                archivo_bz2 = os.path.join(root, archivo)
-                num_tweets_comprimidos += 1
-                tweets += procesar_tweets(archivo_bz2, fecha_inicial, fecha_final, hashtags)
-
-    return tweets, num_tweets_comprimidos
-
-def json_retweets(tweets):
-    retweet_dict = {}
-
-    for tweet in tweets:
-        if 'retweeted_status' in tweet:
-            user_original = tweet['retweeted_status']['user']['screen_name']
-            user_retweeter = tweet['user']['screen_name']
-
-            if user_original not in retweet_dict:
-                retweet_dict[user_original] = {'receivedRetweets': 1, 'tweets': {tweet['retweeted_status']['id_str']: {'retweetedBy': [user_retweeter]}}}
+                archivos.append(os.path.join(root, archivo))
+    num_tweets_comprimidos = len(archivos)
+
+    # En modo incremental solo se leen los archivos que no estaban en el estado guardado
+    if procesados is not None:
+        nuevos = [archivo_bz2 for archivo_bz2 in archivos if os.path.abspath(archivo_bz2) not in procesados]
+        procesados.update((os.path.abspath(archivo_bz2), clave_cache(archivo_bz2)) for archivo_bz2 in nuevos)
+        archivos = nuevos
+
+    # Los archivos cuyo rango de fechas no toca la ventana pedida no se abren
+    archivos = [archivo_bz2 for archivo_bz2 in archivos if debe_leerse(archivo_bz2, directorio, fecha_inicial, fecha_final, indice, fechas_por_ruta)]
+    sin_indice = [indice is not None and rango_indexado(indice, archivo_bz2) is None for archivo_bz2 in archivos]
+
+    if workers > 1:
+        # Cada proceso decodifica y filtra un archivo completo; los parciales se combinan
+        # en el mismo orden de os.walk para que el resultado sea idéntico al secuencial
+        with ProcessPoolExecutor(workers) as executor:
+            parciales = executor.map(procesar_archivo_medido if perfil.activo else procesar_archivo, archivos, repeat(tipos_agregados(agregados)), repeat(fecha_inicial), repeat(fecha_final), repeat(filtro),
+                                     repeat(directorio_cache), sin_indice, repeat(workers_bz2))
+            for archivo_bz2, resultado in zip(archivos, parciales):
+                if perfil.activo:
+                    resultado, medicion = resultado
+                    perfil.sumar(medicion)
+                parcial, rango = resultado
+                with perfil.etapa('combinar'):
+                    combinar_agregados(agregados, parcial)
+                if rango is not None:
+                    registrar_rango(indice, archivo_bz2, rango)
+    elif tuberia is not None and directorio_cache is None and workers_bz2 == 1:
+        # Mientras se filtra un archivo, los siguientes ya se están leyendo y descomprimiendo
+        registrar = dict(zip(archivos, sin_indice))
+        for archivo_bz2, lineas in leer_lineas_solapado(archivos, *tuberia):
+            rango = {} if registrar[archivo_bz2] else None
+            agregar_archivo(agregados, archivo_bz2, fecha_inicial, fecha_final, filtro, rango=rango, lineas=lineas)
+            if rango is not None:
+                registrar_rango(indice, archivo_bz2, rango)
+    else:
+        for archivo_bz2, registrar in zip(archivos, sin_indice):
+            rango = {} if registrar else None
+            agregar_archivo(agregados, archivo_bz2, fecha_inicial, fecha_final, filtro, directorio_cache, rango, workers_bz2)
+            if rango is not None:
+                registrar_rango(indice, archivo_bz2, rango)
+
+    if indice is not None and any(sin_indice):
+        guardar_indice(archivo_indice, indice)
+
+    return num_tweets_comprimidos
+
+# Estado del modo incremental: agregados acumulados, filtros con que se calcularon y archivos ya procesados.
+# VERSION_ESTADO cambia cuando cambia la forma de los agregados y obliga a recalcular
+VERSION_ESTADO = 4
+
+def filtros_estado(fecha_inicial=None, fecha_final=None, filtro=None):
+    return {'fecha_inicial': fecha_inicial, 'fecha_final': fecha_final, 'filtro': filtro.clave() if filtro is not None else None}
+
+def iniciar_incremental(archivo_estado, tipos, filtros):
+    estado = None
+    if os.path.exists(archivo_estado):
+        with open(archivo_estado, 'rb') as file:
+            estado = pickle.load(file)
+    if estado is None or estado.get('version') != VERSION_ESTADO:
+        return crear_agregados(**dict.fromkeys(tipos, True)), {}
+
+    # Los agregados no permiten restar un archivo, así que si algo ya procesado cambió se recalcula todo
+    if estado['filtros'] != filtros:
+        print("Estado incremental con otros filtros, se recalcula desde cero")
+        return crear_agregados(**dict.fromkeys(tipos, True)), {}
+    for archivo_bz2, clave in estado['archivos'].items():
+        if not os.path.exists(archivo_bz2) or clave_cache(archivo_bz2) != clave:
+            print("Archivo ya procesado modificado o borrado (%s), se recalcula desde cero" % archivo_bz2)
+            return crear_agregados(**dict.fromkeys(set(tipos) | set(tipos_agregados(estado['agregados'])), True)), {}
+    if not set(tipos) <= set(tipos_agregados(estado['agregados'])):
+        print("El estado incremental no tiene todos los resultados pedidos, se recalcula desde cero")
+        return crear_agregados(**dict.fromkeys(set(tipos) | set(tipos_agregados(estado['agregados'])), True)), {}
+
+    return estado['agregados'], estado['archivos']
+
+def guardar_estado(archivo_estado, filtros, procesados, agregados):
+    temporal = '%s.%d.tmp' % (archivo_estado, os.getpid())
+    with open(temporal, 'wb') as file:
+        pickle.dump({'version': VERSION_ESTADO, 'filtros': filtros, 'archivos': procesados, 'agregados': agregados}, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporal, archivo_estado)
+
+def crear_agregados(retweets=False, menciones=False, corretweets=False, grafo_retweets=False, grafo_menciones=False):
+    # Solo se crean las estructuras de los resultados pedidos
+    agregados = {}
+    if retweets:
+        agregados['retweets'] = {}
+    if menciones:
+        agregados['menciones'] = {}
+    if corretweets:
+        # dict en lugar de set para conservar el orden de aparición de los retweeters
+        agregados['corretweets'] = defaultdict(dict)
+    if grafo_retweets:
+        # Las aristas van de quien retuitea al autor, pero el autor aparece primero
+        agregados['grafo_retweets'] = crear_grafo(destino_primero=True)
+    if grafo_menciones:
+        agregados['grafo_menciones'] = crear_grafo()
+    if agregados:
+        agregados['usuarios'] = {}
+    return agregados
+
+def tipos_agregados(agregados):
+    return [tipo for tipo in agregados if tipo != 'usuarios']
+
+# Tabla de usuarios compartida por todos los agregadores: cada screen_name se guarda una sola vez,
+# con un id entero en orden de aparición, y los agregadores solo guardan ids. Los nombres se
+# recuperan al escribir los resultados con list(agregados['usuarios'])
+def id_usuario(usuarios, nombre):
+    indice = usuarios.get(nombre)
+    if indice is None:
+        indice = usuarios[nombre] = len(usuarios)
+    return indice
+
+def traducir_usuarios(usuarios, otros):
+    # ids de la tabla otros -> ids de usuarios, internando los nombres nuevos en su orden
+    return [id_usuario(usuarios, nombre) for nombre in otros]
+
+def agregar_tweet(agregados, tweet):
+    usuarios = agregados.get('usuarios')
+    if 'retweets' in agregados:
+        acumular_retweets(agregados['retweets'], tweet, usuarios)
+    if 'menciones' in agregados:
+        acumular_menciones(agregados['menciones'], tweet, usuarios)
+    if 'corretweets' in agregados:
+        acumular_corretweets(agregados['corretweets'], tweet, usuarios)
+    if 'grafo_retweets' in agregados:
+        acumular_grafo_retweets(agregados['grafo_retweets'], tweet, usuarios)
+    if 'grafo_menciones' in agregados:
+        acumular_grafo_menciones(agregados['grafo_menciones'], tweet, usuarios)
+
+def combinar_agregados(agregados, otros):
+    # Une dos agregados parciales (por ejemplo de distintos procesos) en el primero.
+    # Cada parcial tiene su propia tabla de usuarios, los ids del otro se traducen a los de este
+    if 'usuarios' not in agregados:
+        return agregados
+    ids = traducir_usuarios(agregados['usuarios'], otros['usuarios'])
+    if 'retweets' in agregados:
+        combinar_retweets(agregados['retweets'], otros['retweets'], ids)
+    if 'menciones' in agregados:
+        combinar_menciones(agregados['menciones'], otros['menciones'], ids)
+    if 'corretweets' in agregados:
+        for author, retweeters in otros['corretweets'].items():
+            agregados['corretweets'][ids[author]].update(dict.fromkeys(ids[retweeter] for retweeter in retweeters))
+    if 'grafo_retweets' in agregados:
+        combinar_grafos(agregados['grafo_retweets'], otros['grafo_retweets'], ids)
+    if 'grafo_menciones' in agregados:
+        combinar_grafos(agregados['grafo_menciones'], otros['grafo_menciones'], ids)
+    return agregados
+
+def acumular_retweets(retweet_dict, tweet, usuarios):
+    if tweet.retweeted_status is not None:
+        user_original = id_usuario(usuarios, tweet.retweeted_status.screen_name)
+        user_retweeter = id_usuario(usuarios, tweet.screen_name)
+
+        if user_original not in retweet_dict:
+            retweet_dict[user_original] = {'receivedRetweets': 1, 'tweets': {tweet.retweeted_status.id_str: {'retweetedBy': [user_retweeter]}}}
+        else:
+            retweet_dict[user_original]['receivedRetweets'] += 1
+            tweet_id = tweet.retweeted_status.id_str
+            if tweet_id not in retweet_dict[user_original]['tweets']:
+                retweet_dict[user_original]['tweets'][tweet_id] = {'retweetedBy': [user_retweeter]}
             else:
-                retweet_dict[user_original]['receivedRetweets'] += 1
-                tweet_id = tweet['retweeted_status']['id_str']
-                if tweet_id not in retweet_dict[user_original]['tweets']:
-                    retweet_dict[user_original]['tweets'][tweet_id] = {'retweetedBy': [user_retweeter]}
-                else:
-                    retweet_dict[user_original]['tweets'][tweet_id]['retweetedBy'].append(user_retweeter)
-
-    # Ordenar el JSON por número total de retweets al usuario de mayor a menor
-    sorted_retweet_list = sorted(retweet_dict.items(), key=lambda item: item[1]['receivedRetweets'], reverse=True)
-
-    result_json = {'retweets': []}
-    for user, data in sorted_retweet_list:
-        result_json['retweets'].append({'username': user, 'receivedRetweets': data['receivedRetweets'], 'tweets': data['tweets']})
-    
-    with open('rt.json', 'w') as json_file:
-            json.dump(result_json, json_file, indent=4)
+                retweet_dict[user_original]['tweets'][tweet_id]['retweetedBy'].append(user_retweeter)
+
+def combinar_retweets(retweet_dict, otro_dict, ids):
+    for user_original, data in otro_dict.items():
+        user_original = ids[user_original]
+        if user_original not in retweet_dict:
+            retweet_dict[user_original] = {'receivedRetweets': 0, 'tweets': {}}
+        retweet_dict[user_original]['receivedRetweets'] += data['receivedRetweets']
+        tweets = retweet_dict[user_original]['tweets']
+        for tweet_id, tweet_data in data['tweets'].items():
+            retweeted_by = [ids[user_retweeter] for user_retweeter in tweet_data['retweetedBy']]
+            if tweet_id not in tweets:
+                tweets[tweet_id] = {'retweetedBy': retweeted_by}
+            else:
+                tweets[tweet_id]['retweetedBy'] += retweeted_by
+
+def escribir_json(archivo, clave, registros, formato='pretty'):
+    # Escribe {clave: [registros]} registro por registro, sin armar el documento completo en memoria.
+    # 'pretty' produce lo mismo que json.dump(..., indent=4), 'compacto' sin espacios y
+    # 'ndjson' un registro por línea
+    with open(archivo, 'w') as json_file:
+        if formato == 'ndjson':
+            for registro in registros:
+                json_file.write(json.dumps(registro, separators=(',', ':')))
+                json_file.write('\n')
+            return
+
+        if formato == 'compacto':
+            inicio, separador, fin, vacio = '{%s:[' % json.dumps(clave), ',', ']}', '{%s:[]}' % json.dumps(clave)
+            codificar = lambda registro: json.dumps(registro, separators=(',', ':'))
+        else:
+            inicio, separador, fin, vacio = '{\n    %s: [\n' % json.dumps(clave), ',\n', '\n    ]\n}', '{\n    %s: []\n}' % json.dumps(clave)
+            # Los strings de JSON no tienen saltos de línea sin escapar, así que se puede indentar con replace
+            codificar = lambda registro: '        ' + json.dumps(registro, indent=4).replace('\n', '\n        ')
+
+        primero = True
+        for registro in registros:
+            json_file.write(inicio if primero else separador)
+            json_file.write(codificar(registro))
+            primero = False
+        json_file.write(vacio if primero else fin)
+
+def seleccionar(items, clave, top=None, minimo=1):
+    # Mayor a menor según clave, conservando el orden de aparición en los empates. Con top se usa
+    # un heap acotado a K elementos (nlargest equivale a sorted(...)[:top]) en lugar de ordenar todo
+    if minimo > 1:
+        items = (item for item in items if clave(item) >= minimo)
+    if top is None:
+        return sorted(items, key=clave, reverse=True)
+    return heapq.nlargest(top, items, key=clave)
+
+def json_retweets(retweet_dict, nombres, archivo='rt.json', formato='pretty', top=None, minimo=1):
+    # Ordenar el JSON por número total de retweets al usuario de mayor a menor.
+    # nombres traduce los ids de la tabla de usuarios (list(agregados['usuarios']))
+    sorted_retweet_list = seleccionar(retweet_dict.items(), lambda item: item[1]['receivedRetweets'], top, minimo)
+
+    registros = ({'username': nombres[user], 'receivedRetweets': data['receivedRetweets'],
+                  'tweets': {tweet_id: {'retweetedBy': [nombres[user_retweeter] for user_retweeter in tweet_data['retweetedBy']]}
+                             for tweet_id, tweet_data in data['tweets'].items()}}
+                 for user, data in sorted_retweet_list)
+    escribir_json(archivo, 'retweets', registros, formato)
 
     #print("JSON de retweets generado")
 
 
-def json_menciones(tweets):
-    mention_dict = {}
+def acumular_menciones(mention_dict, tweet, usuarios):
+    # Verificar si es un retweet
+    if tweet.retweeted_status is not None:
+        tweet = tweet.retweeted_status  # Utilizar el tweet original en caso de retweet
 
-    for tweet in tweets:
-        # Verificar si es un retweet
-        if 'retweeted_status' in tweet:
-            tweet = tweet['retweeted_status']  # Utilizar el tweet original en caso de retweet
-
-        user_mentions = tweet['entities']['user_mentions']
-        if user_mentions:
-            user_source = tweet['user']['screen_name']
-            for mention in user_mentions:
-                user_target = mention['screen_name']
-                if user_target not in mention_dict:
-                    mention_dict[user_target] = {'receivedMentions': 1, 'mentions': [{'mentionBy': user_source, 'tweets': [tweet['id_str']]}]}
+    user_mentions = tweet.user_mentions
+    if user_mentions:
+        user_source = id_usuario(usuarios, tweet.screen_name)
+        for user_target in user_mentions:
+            user_target = id_usuario(usuarios, user_target)
+            # Índice anidado destino -> fuente -> ids de tweets, cada mención cuesta O(1)
+            if user_target not in mention_dict:
+                mention_dict[user_target] = {'receivedMentions': 1, 'mentions': {user_source: [tweet.id_str]}}
+            else:
+                mention_dict[user_target]['receivedMentions'] += 1
+                mentions = mention_dict[user_target]['mentions']
+                if user_source not in mentions:
+                    mentions[user_source] = [tweet.id_str]
                 else:
-                    mention_dict[user_target]['receivedMentions'] += 1
-                    tweet_id = tweet['id_str']
-                    found = False
-                    for mention_data in mention_dict[user_target]['mentions']:
-                        if mention_data['mentionBy'] == user_source:
-                            mention_data['tweets'].append(tweet_id)
-                            found = True
-                            break
-                    if not found:
-                        mention_dict[user_target]['mentions'].append({'mentionBy': user_source, 'tweets': [tweet_id]})
+                    mentions[user_source].append(tweet.id_str)
+
+def combinar_menciones(mention_dict, otro_dict, ids):
+    for user_target, data in otro_dict.items():
+        user_target = ids[user_target]
+        if user_target not in mention_dict:
+            mention_dict[user_target] = {'receivedMentions': 0, 'mentions': {}}
+        mention_dict[user_target]['receivedMentions'] += data['receivedMentions']
+        mentions = mention_dict[user_target]['mentions']
+        for user_source, tweets in data['mentions'].items():
+            user_source = ids[user_source]
+            if user_source not in mentions:
+                mentions[user_source] = tweets
+            else:
+                mentions[user_source] += tweets
 
+def json_menciones(mention_dict, nombres, archivo='mencion.json', formato='pretty', top=None, minimo=1):
     # Ordenar el JSON por número total de menciones al usuario de mayor a menor
-    sorted_mention_list = sorted(mention_dict.items(), key=lambda item: item[1]['receivedMentions'], reverse=True)
+    sorted_mention_list = seleccionar(mention_dict.items(), lambda item: item[1]['receivedMentions'], top, minimo)
 
-    result_json = {'mentions': []}
-    for user, data in sorted_mention_list:
-        result_json['mentions'].append({'username': user, 'receivedMentions': data['receivedMentions'], 'mentions': data['mentions']})
-
-    with open('mencion.json', 'w') as json_file:
-            json.dump(result_json, json_file, indent=4)
+    # El índice se materializa en el formato de salida al escribir cada usuario, las fuentes en orden de aparición
+    registros = ({'username': nombres[user], 'receivedMentions': data['receivedMentions'],
+                  'mentions': [{'mentionBy': nombres[user_source], 'tweets': tweets} for user_source, tweets in data['mentions'].items()]}
+                 for user, data in sorted_mention_list)
+    escribir_json(archivo, 'mentions', registros, formato)
     #print("JSON menciones generado")
 
 
-def json_corretweets(tweets):
-    corrtweets_json = {"coretweets": []}
-    authors_retweeters = defaultdict(set)
-
+def acumular_corretweets(authors_retweeters, tweet, usuarios):
     # Recopilar información sobre quién retuiteó a cada autor
-    for tweet in tweets:
-        if 'retweeted_status' in tweet:
-            user_original = tweet['retweeted_status']['user']['screen_name']
-            user_retweeter = tweet['user']['screen_name']
-            authors_retweeters[user_original].add(user_retweeter)
-
-    # Generar corrtweets a partir de la información recopilada
+    if tweet.retweeted_status is not None:
+        user_original = id_usuario(usuarios, tweet.retweeted_status.screen_name)
+        user_retweeter = id_usuario(usuarios, tweet.screen_name)
+        authors_retweeters[user_original][user_retweeter] = None
+
+def calcular_corretweets(authors_retweeters, min_coretweets=1, top=None, con_retweeters=True, por_autores=False, parte=0, partes=1):
+    # Los pares se devuelven con los ids de la tabla de usuarios, se traducen a nombres al escribirlos.
+    # Internar autores y retweeters a enteros densos (autores en orden de aparición)
     authors = list(authors_retweeters.keys())
-    for i, author1 in enumerate(authors):
-        for author2 in authors[i + 1:]:
-            common_retweeters = authors_retweeters[author1].intersection(authors_retweeters[author2])
-            if common_retweeters:
-                coretweet_data = {
-                    "authors": {"u1": author1, "u2": author2},
-                    "totalCoretweets": len(common_retweeters),
-                    "retweeters": list(common_retweeters)
-                }
-                corrtweets_json["coretweets"].append(coretweet_data)
-
-    corrtweets_json["coretweets"] = sorted(corrtweets_json["coretweets"], key=lambda x: x["totalCoretweets"], reverse=True)
-
-    '''with open("corrtw.json", "w", encoding="utf-8") as json_file:
-        json.dump(corrtweets_json, json_file, ensure_ascii=False, indent=2)'''
-
-    with open('corrtw.json', 'w') as json_file:
-            json.dump(corrtweets_json, json_file, indent=4)
+    num_authors = len(authors)
+    retweeters = []
+    id_retweeter = {}
+    autores_por_retweeter = []
+
+    # Índice invertido: para cada retweeter, los autores que retuiteó (ids crecientes)
+    for i, author in enumerate(authors):
+        for retweeter in authors_retweeters[author]:
+            r = id_retweeter.get(retweeter)
+            if r is None:
+                r = id_retweeter[retweeter] = len(retweeters)
+                retweeters.append(retweeter)
+                autores_por_retweeter.append([])
+            autores_por_retweeter[r].append(i)
+
+    # Solo se visitan los pares de autores que comparten al menos un retweeter,
+    # cada par se codifica como un entero a * num_authors + b con a < b.
+    # Con partes > 1 solo se calculan los pares cuyo primer autor cumple a % partes == parte
+    conteo = defaultdict(int)
+    for autores in autores_por_retweeter:
+        for i, a in enumerate(autores):
+            if a % partes == parte:
+                for b in autores[i + 1:]:
+                    conteo[a * num_authors + b] += 1
+
+    # Mayor número de corretweets primero; en empate, el orden de los pares de autores
+    pares = [par for par, total in conteo.items() if total >= min_coretweets]
+    if top is not None:
+        pares = heapq.nsmallest(top, pares, key=lambda par: (-conteo[par], par))
+    if por_autores:
+        pares.sort()
+    elif top is None:
+        pares.sort(key=lambda par: (-conteo[par], par))
+
+    comunes = {}
+    if con_retweeters:
+        # Segunda pasada para recolectar los retweeters solo de los pares seleccionados
+        comunes = {par: [] for par in pares}
+        for r, autores in enumerate(autores_por_retweeter):
+            for i, a in enumerate(autores):
+                if a % partes == parte:
+                    for b in autores[i + 1:]:
+                        par = a * num_authors + b
+                        if par in comunes:
+                            comunes[par].append(retweeters[r])
+
+    return [(authors[par // num_authors], authors[par % num_authors], conteo[par], comunes.get(par)) for par in pares]
+
+def mezclar_corretweets(parciales, authors_retweeters, top=None, por_autores=False):
+    # Cada parcial ya viene ordenado (y recortado al top local), basta mezclarlos y recortar al top global
+    posiciones = {author: i for i, author in enumerate(authors_retweeters)}
+    por_total = lambda par: (-par[2], posiciones[par[0]], posiciones[par[1]])
+    if por_autores:
+        clave = lambda par: (posiciones[par[0]], posiciones[par[1]])
+    else:
+        clave = por_total
+    corretweets = heapq.merge(*parciales, key=clave)
+    if top is None:
+        return list(corretweets)
+    if por_autores:
+        # El top es por número de corretweets, se elige y luego se vuelve a ordenar por autores
+        return sorted(heapq.nsmallest(top, corretweets, key=por_total), key=clave)
+    return list(islice(corretweets, top))
+
+def calcular_corretweets_paralelo(authors_retweeters, workers, min_coretweets=1, top=None, con_retweeters=True, por_autores=False):
+    # Cada proceso calcula los pares cuyo primer autor le corresponde
+    with ProcessPoolExecutor(workers) as executor:
+        parciales = list(executor.map(calcular_corretweets, repeat(authors_retweeters, workers), repeat(min_coretweets), repeat(top),
+                                      repeat(con_retweeters), repeat(por_autores), range(workers), repeat(workers)))
+    return mezclar_corretweets(parciales, authors_retweeters, top, por_autores)
+
+def json_corretweets(corretweets, nombres, archivo='corrtw.json', formato='pretty'):
+    # Generar corrtweets a partir de los pares calculados por calcular_corretweets
+    registros = ({
+        "authors": {"u1": nombres[author1], "u2": nombres[author2]},
+        "totalCoretweets": total,
+        "retweeters": [nombres[retweeter] for retweeter in common_retweeters]
+    } for author1, author2, total, common_retweeters in corretweets)
+
+    escribir_json(archivo, 'coretweets', registros, formato)
     #print("JSON corretweets generado")
 
-def generar_grafo_retweets(tweets):
-    G = nx.DiGraph()
-
-    for tweet in tweets:
-        if 'retweeted_status' in tweet:
-            user_original = tweet['retweeted_status']['user']['screen_name']
-            user_retweeter = tweet['user']['screen_name']
-
-            G.add_node(user_original)
-            G.add_node(user_retweeter)
-            G.add_edge(user_retweeter, user_original)
-
-    return G
-
-def generar_grafo_menciones(tweets):
-    G = nx.DiGraph()
-
-    for tweet in tweets:
-        # Verificar si es un retweet
-        if 'retweeted_status' in tweet:
-            tweet = tweet['retweeted_status']  # Utilizar el tweet original en caso de retweet
-
-        user_mentions = tweet['entities']['user_mentions']
-        if user_mentions:
-            user_source = tweet['user']['screen_name']
-            for mention in user_mentions:
-                user_target = mention['screen_name']
-                G.add_node(user_source)
-                G.add_node(user_target)
-                G.add_edge(user_source, user_target)
-
-    return G
-
-def generar_grafo_corretweets(tweets):
-    G = nx.Graph()
-
-    authors_retweeters = defaultdict(set)
-
-    # Recopilar información sobre quién retuiteó a cada autor
-    for tweet in tweets:
-        if 'retweeted_status' in tweet:
-            user_original = tweet['retweeted_status']['user']['screen_name']
-            user_retweeter = tweet['user']['screen_name']
-            authors_retweeters[user_original].add(user_retweeter)
-
-    # Generar corrtweets a partir de la información recopilada
-    authors = list(authors_retweeters.keys())
-    for i, author1 in enumerate(authors):
-        for author2 in authors[i + 1:]:
-            common_retweeters = authors_retweeters[author1].intersection(authors_retweeters[author2])
-            if common_retweeters:
-                G.add_node(author1)
-                G.add_node(author2)
-                G.add_edge(author1, author2, weight=len(common_retweeters))
-
-    return G
+# Los grafos de retweets y menciones se acumulan como un contador de aristas: el peso de cada arista
+# con clave origen << BITS_NODO | destino, con los ids de la tabla de usuarios. Los nodos se exportan en
+# el orden en que aparecen en las aristas (con destino_primero, el destino de cada arista antes que el origen)
+def crear_grafo(destino_primero=False):
+    return {'aristas': {}, 'destino_primero': destino_primero}
+
+def sumar_arista(grafo, origen, destino, peso=1):
+    clave = origen << BITS_NODO | destino
+    aristas = grafo['aristas']
+    aristas[clave] = aristas.get(clave, 0) + peso
+
+def acumular_grafo_retweets(grafo, tweet, usuarios):
+    if tweet.retweeted_status is not None:
+        user_original = id_usuario(usuarios, tweet.retweeted_status.screen_name)
+        user_retweeter = id_usuario(usuarios, tweet.screen_name)
+        sumar_arista(grafo, user_retweeter, user_original)
+
+def acumular_grafo_menciones(grafo, tweet, usuarios):
+    # Verificar si es un retweet
+    if tweet.retweeted_status is not None:
+        tweet = tweet.retweeted_status  # Utilizar el tweet original en caso de retweet
+
+    user_mentions = tweet.user_mentions
+    if user_mentions:
+        user_source = id_usuario(usuarios, tweet.screen_name)
+        for user_target in user_mentions:
+            sumar_arista(grafo, user_source, id_usuario(usuarios, user_target))
+
+def combinar_grafos(grafo, otro, ids):
+    # ids traduce los ids de usuario del otro grafo a los de este
+    for clave, peso in otro['aristas'].items():
+        sumar_arista(grafo, ids[clave >> BITS_NODO], ids[clave & MASCARA_NODO], peso)
+
+def orden_nodos(grafo):
+    # Extremos de las aristas en su orden de inserción, que es el orden en que aparecieron los nodos
+    if grafo['destino_primero']:
+        for clave in grafo['aristas']:
+            yield clave & MASCARA_NODO
+            yield clave >> BITS_NODO
+    else:
+        for clave in grafo['aristas']:
+            yield clave >> BITS_NODO
+            yield clave & MASCARA_NODO
+
+def podar_grafo(grafo, nombres, top=None, minimo=1):
+    # Se conservan las aristas con al menos minimo interacciones y, con top, solo las que unen a los
+    # K usuarios con más interacciones (suma de los pesos de sus aristas). Devuelve el grafo para exportar
+    aristas = grafo['aristas'].items()
+    if minimo > 1:
+        aristas = [(clave, peso) for clave, peso in aristas if peso >= minimo]
+    if top is not None:
+        interacciones = defaultdict(int)
+        for clave, peso in aristas:
+            interacciones[clave >> BITS_NODO] += peso
+            interacciones[clave & MASCARA_NODO] += peso
+        conservar = set(nodo for nodo, _ in seleccionar(interacciones.items(), lambda item: item[1], top))
+        aristas = [(clave, peso) for clave, peso in aristas if clave >> BITS_NODO in conservar and clave & MASCARA_NODO in conservar]
+    return desde_contador(nombres, aristas, orden_nodos(grafo))
+
+def generar_grafo_corretweets(corretweets, nombres):
+    # Los pares calculados por calcular_corretweets van directo a arreglos de enteros,
+    # los autores internados en orden de aparición
+    posiciones = {}
+    origenes, destinos, pesos = array('l'), array('l'), array('l')
+    for author1, author2, total, _ in corretweets:
+        for author in (author1, author2):
+            if author not in posiciones:
+                posiciones[author] = len(posiciones)
+        origenes.append(posiciones[author1])
+        destinos.append(posiciones[author2])
+        pesos.append(total)
+
+    return Aristas([nombres[author] for author in posiciones], origenes, destinos, pesos, dirigido=False)
 
 def main():
 
@@ -217,44 +850,125 @@ def main():
     parser.add_argument('-d', '--dir', type=str, default='data', help='Directorio de entrada')
     parser.add_argument('-fi', '--fecha_inicial', type=lambda s: datetime.strptime(s, '%d-%m-%y'), help='Fecha inicial (dd-mm-aa) para filtrar tweets')
     parser.add_argument('-ff', '--fecha_final', type=lambda s: datetime.strptime(s, '%d-%m-%y'), help='Fecha final (dd-mm-aa) para filtrar tweets')
-    parser.add_argument('-h', '--archivo_hashtags', type=str, help='Archivo de texto con hashtags para filtrar tweets')
+    parser.add_argument('-h', '--archivo_hashtags', type=str,
+                        help='Archivo de texto con hashtags para filtrar tweets (uno por línea, prefijo* para prefijos y re:expresión para expresiones regulares)')
+    parser.add_argument('-ua', '--usuarios_permitidos', type=str, help='Archivo con los usuarios (uno por línea) cuyos tweets se procesan, los demás se descartan')
+    parser.add_argument('-ux', '--usuarios_excluidos', type=str, help='Archivo con los usuarios (uno por línea) cuyos tweets se descartan')
     parser.add_argument('-grt', '--grafo_retweets', action='store_true', help='Generar grafo de retweets (rt.gexf)')
     parser.add_argument('-gm', '--grafo_menciones', action='store_true', help='Generar grafo de menciones (mencion.gexf)')
     parser.add_argument('-gcrt', '--grafo_corretweets', action='store_true', help='Generar grafo de corretweets (corrtw.gexf)')
     parser.add_argument('-jrt', '--json_retweets', action='store_true', help='Generar JSON de retweets (rt.json)')
     parser.add_argument('-jm', '--json_menciones', action='store_true', help='Generar JSON de menciones (menciones.json)')
     parser.add_argument('-jcrt', '--json_corretweets', action='store_true', help='Generar JSON de co-retweets (corrtw.json)')
+    parser.add_argument('-fj', '--formato_json', choices=['pretty', 'compacto', 'ndjson'], default='pretty',
+                        help='Formato de los JSON: indentado (pretty), compacto o un registro por línea (ndjson)')
+    parser.add_argument('-fg', '--formato_grafo', choices=['gexf', 'graphml', 'aristas', 'csr'], default='gexf',
+                        help='Formato de los grafos: GEXF, GraphML, lista de aristas con peso (.ncol) o binario CSR (.csr)')
+    parser.add_argument('-top', '--top', type=int, help='Conservar solo los K usuarios (o pares) con más retweets, menciones o co-retweets')
+    parser.add_argument('-mc', '--min_count', type=int, default=1, help='Mínimo de retweets, menciones o co-retweets para incluir un resultado')
+    parser.add_argument('-mcrt', '--min_coretweets', type=int, help='Mínimo de retweeters en común para incluir un par de autores (por omisión, el de --min_count)')
+    parser.add_argument('-tcrt', '--top_coretweets', type=int, help='Conservar solo los K pares de autores con más co-retweets')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Procesos para leer y filtrar los archivos en paralelo')
+    parser.add_argument('-wcrt', '--workers_corretweets', type=int, default=1, help='Procesos para calcular los co-retweets en paralelo')
+    parser.add_argument('-wbz2', '--workers_bz2', type=int, default=1, help='Procesos para descomprimir en paralelo los bloques de cada archivo')
+    parser.add_argument('-tb', '--tuberia', action='store_true',
+                        help='Leer y descomprimir por adelantado los archivos siguientes mientras se filtra el actual (sin -w, -wbz2 ni -c)')
+    parser.add_argument('-pl', '--profundidad_lectura', type=int, default=8, help='Trozos comprimidos de 1 MB leídos por adelantado en la tubería')
+    parser.add_argument('-pd', '--profundidad_descompresion', type=int, default=8, help='Trozos descomprimidos de 1 MB en espera en la tubería')
+    parser.add_argument('-c', '--cache', type=str, help='Directorio de caché de tweets ya decodificados')
+    parser.add_argument('-lc', '--limpiar_cache', action='store_true', help='Eliminar de la caché las entradas de archivos borrados o modificados')
+    parser.add_argument('-idx', '--indice', type=str, help='Archivo con el índice de fechas de cada archivo de entrada (se crea si no existe)')
+    parser.add_argument('-fr', '--fechas_ruta', action='store_true', help='Deducir el rango de fechas de cada archivo de su ruta año/mes/día/hora')
+    parser.add_argument('-inc', '--incremental', type=str, help='Archivo de estado: solo se leen los archivos nuevos y se combinan con lo ya calculado')
+    parser.add_argument('-prof', '--profile', type=str, help='Guardar un reporte JSON con tiempos, volumen y memoria de cada etapa')
+    parser.add_argument('-tm', '--tracemalloc', action='store_true', help='Incluir en el reporte la memoria pico de Python y las líneas que más asignan')
+    parser.add_argument('-cprof', '--cprofile', type=str, help='Guardar las estadísticas de cProfile de toda la corrida en este archivo')
     args = parser.parse_args()
-
-    
+    # La tubería reemplaza a la lectura con -w, -wbz2 y -c, no se combina con ellas
+    if args.tuberia and (args.workers > 1 or args.workers_bz2 > 1 or args.cache is not None):
+        parser.error("-tb no se puede combinar con -w, -wbz2 ni -c")
+    # Una cola de tamaño 0 o negativo no tiene límite y la tubería podría ocupar toda la memoria
+    if args.profundidad_lectura < 1 or args.profundidad_descompresion < 1:
+        parser.error("-pl y -pd deben ser al menos 1")
+
+    if args.profile is not None or args.cprofile is not None:
+        perfil.iniciar(args.tracemalloc, args.cprofile is not None)
     
     directorio_completo = os.path.abspath(args.dir)
-    tweets, num_tweets_comprimidos = procesar_directorio(directorio_completo, args.fecha_inicial, args.fecha_final, args.archivo_hashtags)
+    filtro = leer_filtro(args.archivo_hashtags, args.usuarios_permitidos, args.usuarios_excluidos)
+    # Un solo recorrido de los archivos alimenta todos los resultados pedidos
+    agregados = crear_agregados(retweets=args.json_retweets,
+                                menciones=args.json_menciones,
+                                corretweets=args.json_corretweets or args.grafo_corretweets,
+                                grafo_retweets=args.grafo_retweets,
+                                grafo_menciones=args.grafo_menciones)
+    procesados = None
+    if args.incremental is not None:
+        with perfil.etapa('estado_incremental'):
+            filtros = filtros_estado(args.fecha_inicial, args.fecha_final, filtro)
+            agregados, procesados = iniciar_incremental(args.incremental, tipos_agregados(agregados), filtros)
+
+    if args.cache is not None and args.limpiar_cache:
+        limpiar_cache(args.cache)
+    with perfil.etapa('lectura'):
+        num_tweets_comprimidos = procesar_directorio(directorio_completo, agregados, args.fecha_inicial, args.fecha_final, filtro,
+                                                     args.workers, args.cache, args.indice, args.fechas_ruta, procesados, args.workers_bz2,
+                                                     (args.profundidad_lectura, args.profundidad_descompresion) if args.tuberia else None)
+
+    if args.incremental is not None:
+        with perfil.etapa('estado_incremental'):
+            guardar_estado(args.incremental, filtros, procesados, agregados)
+
+    # Los resultados guardan ids de usuario, se traducen a screen_name al escribirlos
+    nombres = list(agregados.get('usuarios', ()))
 
     if args.json_retweets:
-        json_retweets(tweets)
+        with perfil.etapa('json_retweets'):
+            json_retweets(agregados['retweets'], nombres, formato=args.formato_json, top=args.top, minimo=args.min_count)
     
     if args.json_menciones:
-        json_menciones(tweets)
+        with perfil.etapa('json_menciones'):
+            json_menciones(agregados['menciones'], nombres, formato=args.formato_json, top=args.top, minimo=args.min_count)
+
+    # -tcrt/-mcrt tienen prioridad sobre --top/--min_count para los co-retweets
+    top_corretweets = args.top_coretweets if args.top_coretweets is not None else args.top
+    min_corretweets = args.min_coretweets if args.min_coretweets is not None else args.min_count
 
     if args.json_corretweets:
-        json_corretweets(tweets)
+        with perfil.etapa('corretweets'):
+            if args.workers_corretweets > 1:
+                corretweets = calcular_corretweets_paralelo(agregados['corretweets'], args.workers_corretweets, min_corretweets, top_corretweets)
+            else:
+                corretweets = calcular_corretweets(agregados['corretweets'], min_corretweets, top_corretweets)
+        with perfil.etapa('json_corretweets'):
+            json_corretweets(corretweets, nombres, formato=args.formato_json)
 
     if args.grafo_retweets:
-        grafo_retweets = generar_grafo_retweets(tweets)
-        nx.write_gexf(grafo_retweets, 'rt.gexf')
+        with perfil.etapa('grafo_retweets'):
+            exportar_grafo(podar_grafo(agregados['grafo_retweets'], nombres, args.top, args.min_count), 'rt', args.formato_grafo)
         #print("Grafo de retweets generado (rt.gexf)")
     
     if args.grafo_menciones:
-        grafo_menciones = generar_grafo_menciones(tweets)
-        nx.write_gexf(grafo_menciones, 'mencion.gexf')
+        with perfil.etapa('grafo_menciones'):
+            exportar_grafo(podar_grafo(agregados['grafo_menciones'], nombres, args.top, args.min_count), 'mencion', args.formato_grafo)
         #print("Grafo de menciones generado (mencion.gexf)")
     
     if args.grafo_corretweets:
-        grafo_corretweets = generar_grafo_corretweets(tweets)
-        nx.write_gexf(grafo_corretweets, 'corrtw.gexf')
+        with perfil.etapa('corretweets_grafo'):
+            if args.workers_corretweets > 1:
+                corretweets = calcular_corretweets_paralelo(agregados['corretweets'], args.workers_corretweets, min_corretweets, top_corretweets,
+                                                            con_retweeters=False, por_autores=True)
+            else:
+                corretweets = calcular_corretweets(agregados['corretweets'], min_corretweets, top_corretweets, con_retweeters=False, por_autores=True)
+        with perfil.etapa('grafo_corretweets'):
+            grafo_corretweets = generar_grafo_corretweets(corretweets, nombres)
+            exportar_grafo(grafo_corretweets, 'corrtw', args.formato_grafo)
         #print("Grafo de co-retweets generado (corrtw.gexf)")
 
+    perfil.terminar(args.cprofile)
+    if args.profile is not None:
+        perfil.guardar_reporte(args.profile, [perfil.reporte()], script='generador.py', argumentos=vars(args))
+        print("Reporte de perfil guardado en", args.profile)
     print("Tiempo de ejecución total:", time.time() - start_time, "segundos")
    # print("Argumentos ingresados: ", args)
 if __name__ == "__main__":
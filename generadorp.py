@@ -1,218 +1,131 @@
 import os
-import json
-import bz2
 import sys
 import time
-import networkx as nx
 from datetime import datetime
-from collections import defaultdict
 import argparse
+from array import array
+from generador import agregar_archivo, limpiar_cache, cargar_indice, guardar_indice, registrar_rango, rango_indexado, debe_leerse
+from generador import filtros_estado, iniciar_incremental, guardar_estado, clave_cache
+from generador import crear_agregados, combinar_agregados, tipos_agregados
+from generador import calcular_corretweets, mezclar_corretweets, json_retweets, json_menciones, json_corretweets, generar_grafo_corretweets, podar_grafo
+from grafos import exportar_grafo
+from filtro import leer_filtro
+from bz2paralelo import leer_lineas_solapado
+import perfil
 from mpi4py import MPI
 comm = MPI.COMM_WORLD
 rank = comm.Get_rank()
 size = comm.Get_size()
 
 
-def procesar_tweets(archivo_bz2, fecha_inicial=None, fecha_final=None, hashtags=None):
-    tweets = []
-
-    with bz2.BZ2File(archivo_bz2, 'rb') as f_in:
-        for line in f_in:
-            tweet_data = json.loads(line.decode('utf-8'))
-
-            if 'created_at' in tweet_data:
-                created_at = datetime.strptime(tweet_data['created_at'], '%a %b %d %H:%M:%S +0000 %Y')
-
-                # Verifica si el tweet está dentro del rango de fechas
-                if (fecha_inicial is None or created_at >= fecha_inicial) and (fecha_final is None or created_at <= fecha_final):
-                    # Verifica si el tweet contiene al menos uno de los hashtags especificados
-                    if hashtags is None or tiene_hashtags(tweet_data, hashtags):
-                        tweets.append(tweet_data)
-
-    return tweets
-
-def tiene_hashtags(tweet, hashtags):
-    tweet_hashtags = set(hashtag['text'].lower() for hashtag in tweet['entities']['hashtags'])
-    return bool(hashtags.intersection(tweet_hashtags))
-
-def procesar_directorio(directorio, fecha_inicial=None, fecha_final=None, archivo_hashtags=None):
+def listar_archivos(directorio, fecha_inicial=None, fecha_final=None, indice=None, fechas_por_ruta=False, procesados=None):
+    archivos = []
+    for root, _, files in os.walk(directorio):
+        for archivo in files:
+            if archivo.endswith('.json.bz2'):
+                archivo_bz2 = os.path.join(root, archivo)
+                # En modo incremental solo se reparten los archivos que no estaban en el estado guardado
+                if procesados is not None:
+                    if os.path.abspath(archivo_bz2) in procesados:
+                        continue
+                    procesados[os.path.abspath(archivo_bz2)] = clave_cache(archivo_bz2)
+                # Los archivos cuyo rango de fechas no toca la ventana pedida no se reparten
+                if debe_leerse(archivo_bz2, directorio, fecha_inicial, fecha_final, indice, fechas_por_ruta):
+                    archivos.append((os.path.getsize(archivo_bz2), archivo_bz2))
+
+    # Los archivos más grandes primero, así los últimos en repartirse son los más pequeños
+    archivos.sort(key=lambda item: (-item[0], item[1]))
+    return archivos
+
+def repartir_archivos(archivos):
+    # Con un solo proceso no hace falta coordinar nada
+    if size == 1:
+        yield from archivos
+        return
+
+    # Contador global en rank 0: cada rank toma el siguiente archivo libre de forma atómica
+    # hasta que se acaben, así ningún rank se queda sin trabajo mientras otro tiene cola
+    contador = array('q', [0])
+    ventana = MPI.Win.Create(contador, comm=comm)
+    uno = array('q', [1])
+    siguiente = array('q', [0])
+
+    while True:
+        ventana.Lock(0)
+        ventana.Fetch_and_op([uno, MPI.INT64_T], [siguiente, MPI.INT64_T], 0, 0, MPI.SUM)
+        ventana.Unlock(0)
+        if siguiente[0] >= len(archivos):
+            break
+        yield archivos[siguiente[0]]
+
+    comm.Barrier()
+    ventana.Free()
+
+def procesar_directorio(directorio, agregados, fecha_inicial=None, fecha_final=None, filtro=None, directorio_cache=None,
+                        archivo_indice=None, fechas_por_ruta=False, procesados=None, workers_bz2=1, tuberia=None):
     num_tweets_comprimidos = 0
-    tweets = []
-
-    hashtags = None
-    if archivo_hashtags is not None:
-        with open(archivo_hashtags, 'r') as file:
-            hashtags = set(line.strip().lower() for line in file)
-
-    for i, (root, _, files) in enumerate(os.walk(directorio)):
-        if i % size == rank:
-            for archivo in files:
-                if archivo.endswith('.json.bz2'):
-                    archivo_bz2 = os.path.join(root, archivo)
-                    num_tweets_comprimidos += 1
-                    tweets += procesar_tweets(archivo_bz2, fecha_inicial, fecha_final, hashtags)
-
-    return tweets, num_tweets_comprimidos
-
-def json_retweets(tweets):
-    retweet_dict = {}
-
-    for tweet in tweets:
-        if 'retweeted_status' in tweet:
-            user_original = tweet['retweeted_status']['user']['screen_name']
-            user_retweeter = tweet['user']['screen_name']
-
-            if user_original not in retweet_dict:
-                retweet_dict[user_original] = {'receivedRetweets': 1, 'tweets': {tweet['retweeted_status']['id_str']: {'retweetedBy': [user_retweeter]}}}
-            else:
-                retweet_dict[user_original]['receivedRetweets'] += 1
-                tweet_id = tweet['retweeted_status']['id_str']
-                if tweet_id not in retweet_dict[user_original]['tweets']:
-                    retweet_dict[user_original]['tweets'][tweet_id] = {'retweetedBy': [user_retweeter]}
-                else:
-                    retweet_dict[user_original]['tweets'][tweet_id]['retweetedBy'].append(user_retweeter)
-
-    # Ordenar el JSON por número total de retweets al usuario de mayor a menor
-    sorted_retweet_list = sorted(retweet_dict.items(), key=lambda item: item[1]['receivedRetweets'], reverse=True)
-
-    result_json = {'retweets': []}
-    for user, data in sorted_retweet_list:
-        result_json['retweets'].append({'username': user, 'receivedRetweets': data['receivedRetweets'], 'tweets': data['tweets']})
-    
-    with open('rtp.json', 'w') as json_file:
-            json.dump(result_json, json_file, indent=4)
-
-    #print("JSON de retweets generado")
-
-
-def json_menciones(tweets):
-    mention_dict = {}
-
-    for tweet in tweets:
-        # Verificar si es un retweet
-        if 'retweeted_status' in tweet:
-            tweet = tweet['retweeted_status']  # Utilizar el tweet original en caso de retweet
-
-        user_mentions = tweet['entities']['user_mentions']
-        if user_mentions:
-            user_source = tweet['user']['screen_name']
-            for mention in user_mentions:
-                user_target = mention['screen_name']
-                if user_target not in mention_dict:
-                    mention_dict[user_target] = {'receivedMentions': 1, 'mentions': [{'mentionBy': user_source, 'tweets': [tweet['id_str']]}]}
-                else:
-                    mention_dict[user_target]['receivedMentions'] += 1
-                    tweet_id = tweet['id_str']
-                    found = False
-                    for mention_data in mention_dict[user_target]['mentions']:
-                        if mention_data['mentionBy'] == user_source:
-                            mention_data['tweets'].append(tweet_id)
-                            found = True
-                            break
-                    if not found:
-                        mention_dict[user_target]['mentions'].append({'mentionBy': user_source, 'tweets': [tweet_id]})
-
-    # Ordenar el JSON por número total de menciones al usuario de mayor a menor
-    sorted_mention_list = sorted(mention_dict.items(), key=lambda item: item[1]['receivedMentions'], reverse=True)
-
-    result_json = {'mentions': []}
-    for user, data in sorted_mention_list:
-        result_json['mentions'].append({'username': user, 'receivedMentions': data['receivedMentions'], 'mentions': data['mentions']})
-
-    with open('mencionp.json', 'w') as json_file:
-            json.dump(result_json, json_file, indent=4)
-    #print("JSON menciones generado")
-
-
-def json_corretweets(tweets):
-    corrtweets_json = {"coretweets": []}
-    authors_retweeters = defaultdict(set)
-
-    # Recopilar información sobre quién retuiteó a cada autor
-    for tweet in tweets:
-        if 'retweeted_status' in tweet:
-            user_original = tweet['retweeted_status']['user']['screen_name']
-            user_retweeter = tweet['user']['screen_name']
-            authors_retweeters[user_original].add(user_retweeter)
-
-    # Generar corrtweets a partir de la información recopilada
-    authors = list(authors_retweeters.keys())
-    for i, author1 in enumerate(authors):
-        for author2 in authors[i + 1:]:
-            common_retweeters = authors_retweeters[author1].intersection(authors_retweeters[author2])
-            if common_retweeters:
-                coretweet_data = {
-                    "authors": {"u1": author1, "u2": author2},
-                    "totalCoretweets": len(common_retweeters),
-                    "retweeters": list(common_retweeters)
-                }
-                corrtweets_json["coretweets"].append(coretweet_data)
-
-    corrtweets_json["coretweets"] = sorted(corrtweets_json["coretweets"], key=lambda x: x["totalCoretweets"], reverse=True)
-
-    '''with open("corrtw.json", "w", encoding="utf-8") as json_file:
-        json.dump(corrtweets_json, json_file, ensure_ascii=False, indent=2)'''
-
-    with open('corrtwp.json', 'w') as json_file:
-            json.dump(corrtweets_json, json_file, indent=4)
-    #print("JSON corretweets generado")
-
-def generar_grafo_retweets(tweets):
-    G = nx.DiGraph()
-
-    for tweet in tweets:
-        if 'retweeted_status' in tweet:
-            user_original = tweet['retweeted_status']['user']['screen_name']
-            user_retweeter = tweet['user']['screen_name']
-
-            G.add_node(user_original)
-            G.add_node(user_retweeter)
-            G.add_edge(user_retweeter, user_original)
-
-    return G
-
-def generar_grafo_menciones(tweets):
-    G = nx.DiGraph()
-
-    for tweet in tweets:
-        # Verificar si es un retweet
-        if 'retweeted_status' in tweet:
-            tweet = tweet['retweeted_status']  # Utilizar el tweet original en caso de retweet
-
-        user_mentions = tweet['entities']['user_mentions']
-        if user_mentions:
-            user_source = tweet['user']['screen_name']
-            for mention in user_mentions:
-                user_target = mention['screen_name']
-                G.add_node(user_source)
-                G.add_node(user_target)
-                G.add_edge(user_source, user_target)
-
-    return G
-
-def generar_grafo_corretweets(tweets):
-    G = nx.Graph()
-
-    authors_retweeters = defaultdict(set)
-
-    # Recopilar información sobre quién retuiteó a cada autor
-    for tweet in tweets:
-        if 'retweeted_status' in tweet:
-            user_original = tweet['retweeted_status']['user']['screen_name']
-            user_retweeter = tweet['user']['screen_name']
-            authors_retweeters[user_original].add(user_retweeter)
-
-    # Generar corrtweets a partir de la información recopilada
-    authors = list(authors_retweeters.keys())
-    for i, author1 in enumerate(authors):
-        for author2 in authors[i + 1:]:
-            common_retweeters = authors_retweeters[author1].intersection(authors_retweeters[author2])
-            if common_retweeters:
-                G.add_node(author1)
-                G.add_node(author2)
-                G.add_edge(author1, author2, weight=len(common_retweeters))
-
-    return G
+    carga = {'rank': rank, 'archivos': 0, 'bytes': 0, 'tweets': 0, 'segundos': 0.0}
+
+    # Rank 0 lista los archivos y todos reciben el mismo orden, junto con los que faltan en el índice
+    archivos = sin_indice = None
+    if rank == 0:
+        indice = cargar_indice(archivo_indice) if archivo_indice is not None else None
+        archivos = listar_archivos(directorio, fecha_inicial, fecha_final, indice, fechas_por_ruta, procesados)
+        sin_indice = set(archivo_bz2 for _, archivo_bz2 in archivos if indice is not None and rango_indexado(indice, archivo_bz2) is None)
+    archivos, sin_indice = comm.bcast((archivos, sin_indice), root=0)
+    rangos = {}
+
+    for tam, archivo_bz2 in repartir_archivos(archivos):
+        inicio = time.time()
+        num_tweets_comprimidos += 1
+        rango = {} if archivo_bz2 in sin_indice else None
+        # Cada rank agrega sus tweets localmente, los tweets nunca salen del rank
+        if tuberia is not None and directorio_cache is None and workers_bz2 == 1:
+            # Los archivos se toman de a uno del contador, así que la tubería solapa la lectura y el filtrado del mismo archivo
+            for _, lineas in leer_lineas_solapado([archivo_bz2], *tuberia):
+                carga['tweets'] += agregar_archivo(agregados, archivo_bz2, fecha_inicial, fecha_final, filtro, rango=rango, lineas=lineas)
+        else:
+            carga['tweets'] += agregar_archivo(agregados, archivo_bz2, fecha_inicial, fecha_final, filtro, directorio_cache, rango, workers_bz2)
+        if rango is not None:
+            rangos[archivo_bz2] = rango
+
+        carga['archivos'] += 1
+        carga['bytes'] += tam
+        carga['segundos'] += time.time() - inicio
+
+    # Rank 0 junta los rangos de fechas leídos por todos y actualiza el índice
+    rangos = comm.gather(rangos, root=0)
+    if rank == 0 and sin_indice:
+        for rangos_rank in rangos:
+            for archivo_bz2, rango in rangos_rank.items():
+                registrar_rango(indice, archivo_bz2, rango)
+        guardar_indice(archivo_indice, indice)
+
+    return num_tweets_comprimidos, carga
+
+def reportar_carga(cargas):
+    print("Carga por rank:")
+    for carga in cargas:
+        print("  rank %d: %d archivos, %.1f MB, %d tweets, %.2f segundos" % (
+            carga['rank'], carga['archivos'], carga['bytes'] / 1e6, carga['tweets'], carga['segundos']))
+    tiempos = [carga['segundos'] for carga in cargas]
+    if tiempos and max(tiempos) > 0:
+        print("  desbalance (max/promedio): %.2f" % (max(tiempos) / (sum(tiempos) / len(tiempos))))
+
+def calcular_corretweets_distribuido(authors_retweeters, min_coretweets=1, top=None, con_retweeters=True, por_autores=False):
+    # Todos los ranks reciben los autores (como ids de usuario) y cada uno calcula los pares cuyo primer autor le corresponde
+    with perfil.etapa('corretweets_bcast'):
+        authors_retweeters = comm.bcast(authors_retweeters, root=0)
+    with perfil.etapa('corretweets_calculo'):
+        parcial = calcular_corretweets(authors_retweeters, min_coretweets, top, con_retweeters, por_autores, parte=rank, partes=size)
+    with perfil.etapa('corretweets_gather'):
+        parciales = comm.gather(parcial, root=0)
+
+    if rank != 0:
+        return None
+
+    with perfil.etapa('corretweets_mezcla'):
+        return mezclar_corretweets(parciales, authors_retweeters, top, por_autores)
 
 def main():
     start_time = time.time()
@@ -220,48 +133,142 @@ def main():
     parser.add_argument('-d', '--dir', type=str, default='data', help='Directorio de entrada')
     parser.add_argument('-fi', '--fecha_inicial', type=lambda s: datetime.strptime(s, '%d-%m-%y'), help='Fecha inicial (dd-mm-aa) para filtrar tweets')
     parser.add_argument('-ff', '--fecha_final', type=lambda s: datetime.strptime(s, '%d-%m-%y'), help='Fecha final (dd-mm-aa) para filtrar tweets')
-    parser.add_argument('-h', '--archivo_hashtags', type=str, help='Archivo de texto con hashtags para filtrar tweets')
+    parser.add_argument('-h', '--archivo_hashtags', type=str,
+                        help='Archivo de texto con hashtags para filtrar tweets (uno por línea, prefijo* para prefijos y re:expresión para expresiones regulares)')
+    parser.add_argument('-ua', '--usuarios_permitidos', type=str, help='Archivo con los usuarios (uno por línea) cuyos tweets se procesan, los demás se descartan')
+    parser.add_argument('-ux', '--usuarios_excluidos', type=str, help='Archivo con los usuarios (uno por línea) cuyos tweets se descartan')
     parser.add_argument('-grt', '--grafo_retweets', action='store_true', help='Generar grafo de retweets (rt.gexf)')
     parser.add_argument('-gm', '--grafo_menciones', action='store_true', help='Generar grafo de menciones (mencion.gexf)')
     parser.add_argument('-gcrt', '--grafo_corretweets', action='store_true', help='Generar grafo de corretweets (corrtw.gexf)')
     parser.add_argument('-jrt', '--json_retweets', action='store_true', help='Generar JSON de retweets (rt.json)')
     parser.add_argument('-jm', '--json_menciones', action='store_true', help='Generar JSON de menciones (menciones.json)')
     parser.add_argument('-jcrt', '--json_corretweets', action='store_true', help='Generar JSON de co-retweets (corrtw.json)')
+    parser.add_argument('-fj', '--formato_json', choices=['pretty', 'compacto', 'ndjson'], default='pretty',
+                        help='Formato de los JSON: indentado (pretty), compacto o un registro por línea (ndjson)')
+    parser.add_argument('-fg', '--formato_grafo', choices=['gexf', 'graphml', 'aristas', 'csr'], default='gexf',
+                        help='Formato de los grafos: GEXF, GraphML, lista de aristas con peso (.ncol) o binario CSR (.csr)')
+    parser.add_argument('-top', '--top', type=int, help='Conservar solo los K usuarios (o pares) con más retweets, menciones o co-retweets')
+    parser.add_argument('-mc', '--min_count', type=int, default=1, help='Mínimo de retweets, menciones o co-retweets para incluir un resultado')
+    parser.add_argument('-mcrt', '--min_coretweets', type=int, help='Mínimo de retweeters en común para incluir un par de autores (por omisión, el de --min_count)')
+    parser.add_argument('-tcrt', '--top_coretweets', type=int, help='Conservar solo los K pares de autores con más co-retweets')
+    parser.add_argument('-wbz2', '--workers_bz2', type=int, default=1, help='Procesos por rank para descomprimir en paralelo los bloques de cada archivo')
+    parser.add_argument('-tb', '--tuberia', action='store_true',
+                        help='Solapar la lectura y descompresión de cada archivo con su filtrado (sin -wbz2 ni -c)')
+    parser.add_argument('-pl', '--profundidad_lectura', type=int, default=8, help='Trozos comprimidos de 1 MB leídos por adelantado en la tubería')
+    parser.add_argument('-pd', '--profundidad_descompresion', type=int, default=8, help='Trozos descomprimidos de 1 MB en espera en la tubería')
+    parser.add_argument('-c', '--cache', type=str, help='Directorio de caché de tweets ya decodificados')
+    parser.add_argument('-lc', '--limpiar_cache', action='store_true', help='Eliminar de la caché las entradas de archivos borrados o modificados')
+    parser.add_argument('-idx', '--indice', type=str, help='Archivo con el índice de fechas de cada archivo de entrada (se crea si no existe)')
+    parser.add_argument('-fr', '--fechas_ruta', action='store_true', help='Deducir el rango de fechas de cada archivo de su ruta año/mes/día/hora')
+    parser.add_argument('-inc', '--incremental', type=str, help='Archivo de estado: solo se leen los archivos nuevos y se combinan con lo ya calculado')
+    parser.add_argument('-prof', '--profile', type=str, help='Guardar un reporte JSON con tiempos, volumen y memoria de cada etapa en cada rank')
+    parser.add_argument('-tm', '--tracemalloc', action='store_true', help='Incluir en el reporte la memoria pico de Python y las líneas que más asignan')
+    parser.add_argument('-cprof', '--cprofile', type=str, help='Guardar las estadísticas de cProfile de cada rank (con sufijo .rank si hay más de uno)')
     args = parser.parse_args()
-
+    # La tubería reemplaza a la lectura con -wbz2 y -c, no se combina con ellas
+    if args.tuberia and (args.workers_bz2 > 1 or args.cache is not None):
+        parser.error("-tb no se puede combinar con -wbz2 ni -c")
+    # Una cola de tamaño 0 o negativo no tiene límite y la tubería podría ocupar toda la memoria
+    if args.profundidad_lectura < 1 or args.profundidad_descompresion < 1:
+        parser.error("-pl y -pd deben ser al menos 1")
+
+    if args.profile is not None or args.cprofile is not None:
+        perfil.iniciar(args.tracemalloc, args.cprofile is not None)
     
     directorio_completo = os.path.abspath(args.dir)
-    #tweets, num_tweets_comprimidos = procesar_directorio(directorio_completo, args.fecha_inicial, args.fecha_final, args.archivo_hashtags)
-
-    tweets_local, num_tweets_local = procesar_directorio(directorio_completo, args.fecha_inicial, args.fecha_final, args.archivo_hashtags)
-    tweets_globales = comm.gather(tweets_local, root=0)
-    num_tweets_globales = comm.gather(num_tweets_local, root=0)
+    filtro = leer_filtro(args.archivo_hashtags, args.usuarios_permitidos, args.usuarios_excluidos)
+    agregados = crear_agregados(retweets=args.json_retweets,
+                                menciones=args.json_menciones,
+                                corretweets=args.json_corretweets or args.grafo_corretweets,
+                                grafo_retweets=args.grafo_retweets,
+                                grafo_menciones=args.grafo_menciones)
+
+    # En modo incremental rank 0 carga el estado y todos los ranks agregan los mismos tipos que guarda
+    previos = procesados = None
+    if args.incremental is not None:
+        if rank == 0:
+            with perfil.etapa('estado_incremental'):
+                filtros = filtros_estado(args.fecha_inicial, args.fecha_final, filtro)
+                previos, procesados = iniciar_incremental(args.incremental, tipos_agregados(agregados), filtros)
+        tipos = comm.bcast(tipos_agregados(previos) if rank == 0 else None, root=0)
+        agregados = crear_agregados(**dict.fromkeys(tipos, True))
+
+    if args.cache is not None and args.limpiar_cache:
+        if rank == 0:
+            limpiar_cache(args.cache)
+        comm.Barrier()
+
+    with perfil.etapa('lectura'):
+        num_tweets_local, carga_local = procesar_directorio(directorio_completo, agregados, args.fecha_inicial, args.fecha_final, filtro,
+                                                            args.cache, args.indice, args.fechas_ruta, procesados, args.workers_bz2,
+                                                            (args.profundidad_lectura, args.profundidad_descompresion) if args.tuberia else None)
+
+    # Al perfilar, la espera en la barrera separa el desbalance de carga del costo real de la reducción
+    if perfil.activo:
+        with perfil.etapa('espera'):
+            comm.Barrier()
+
+    # Reducción en árbol: solo viajan los agregados parciales y se combinan en log2(size) pasos
+    inicio_reduccion = time.time()
+    with perfil.etapa('reduccion'):
+        agregados = comm.reduce(agregados, op=combinar_agregados, root=0)
+        num_tweets_comprimidos = comm.reduce(num_tweets_local, op=MPI.SUM, root=0)
+        cargas = comm.gather(carga_local, root=0)
+    # Se mide aquí: lo que sigue (estado incremental, co-retweets) no es parte de la reducción
+    tiempo_reduccion = time.time() - inicio_reduccion
+
+    if rank == 0 and args.incremental is not None:
+        with perfil.etapa('estado_incremental'):
+            agregados = combinar_agregados(previos, agregados)
+            guardar_estado(args.incremental, filtros, procesados, agregados)
+
+    # Los co-retweets se reparten entre todos los ranks; -tcrt/-mcrt tienen prioridad sobre --top/--min_count
+    top_corretweets = args.top_coretweets if args.top_coretweets is not None else args.top
+    min_corretweets = args.min_coretweets if args.min_coretweets is not None else args.min_count
+    if args.json_corretweets:
+        corretweets = calcular_corretweets_distribuido(agregados['corretweets'] if rank == 0 else None, min_corretweets, top_corretweets)
+    if args.grafo_corretweets:
+        corretweets_grafo = calcular_corretweets_distribuido(agregados['corretweets'] if rank == 0 else None, min_corretweets, top_corretweets,
+                                                             con_retweeters=False, por_autores=True)
 
     if rank == 0:
-        tweets = [tweet for sublist in tweets_globales for tweet in sublist]
-        num_tweets_comprimidos = sum(num_tweets_globales)
+        reportar_carga(cargas)
+        print("Tiempo de reducción:", tiempo_reduccion, "segundos")
+        # Los resultados guardan ids de la tabla de usuarios ya combinada, se traducen a screen_name al escribirlos
+        nombres = list(agregados.get('usuarios', ()))
 
-    if rank == 0:
         if args.json_retweets:
-            json_retweets(tweets)
+            with perfil.etapa('json_retweets'):
+                json_retweets(agregados['retweets'], nombres, 'rtp.json', args.formato_json, args.top, args.min_count)
     
         if args.json_menciones:
-            json_menciones(tweets)
+            with perfil.etapa('json_menciones'):
+                json_menciones(agregados['menciones'], nombres, 'mencionp.json', args.formato_json, args.top, args.min_count)
 
         if args.json_corretweets:
-            json_corretweets(tweets)
+            with perfil.etapa('json_corretweets'):
+                json_corretweets(corretweets, nombres, 'corrtwp.json', args.formato_json)
 
         if args.grafo_retweets:
-            grafo_retweets = generar_grafo_retweets(tweets)
-            nx.write_gexf(grafo_retweets, 'rtp.gexf')
+            with perfil.etapa('grafo_retweets'):
+                exportar_grafo(podar_grafo(agregados['grafo_retweets'], nombres, args.top, args.min_count), 'rtp', args.formato_grafo)
     
         if args.grafo_menciones:
-            grafo_menciones = generar_grafo_menciones(tweets)
-            nx.write_gexf(grafo_menciones, 'mencionp.gexf')
+            with perfil.etapa('grafo_menciones'):
+                exportar_grafo(podar_grafo(agregados['grafo_menciones'], nombres, args.top, args.min_count), 'mencionp', args.formato_grafo)
     
         if args.grafo_corretweets:
-            grafo_corretweets = generar_grafo_corretweets(tweets)
-            nx.write_gexf(grafo_corretweets, 'corrtwp.gexf')
+            with perfil.etapa('grafo_corretweets'):
+                grafo_corretweets = generar_grafo_corretweets(corretweets_grafo, nombres)
+                exportar_grafo(grafo_corretweets, 'corrtwp', args.formato_grafo)
+
+    # Cada rank guarda su cProfile y rank 0 junta los reportes de todos
+    perfil.terminar(args.cprofile + ('.%d' % rank if size > 1 else '') if args.cprofile is not None else None)
+    if args.profile is not None:
+        reportes = comm.gather(perfil.reporte(rank), root=0)
+        if rank == 0:
+            perfil.guardar_reporte(args.profile, reportes, script='generadorp.py', ranks=size, argumentos=vars(args))
+            print("Reporte de perfil guardado en", args.profile)
 
     print("Tiempo de ejecución total:", time.time() - start_time, "segundos")
 if __name__ == "__main__":
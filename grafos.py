@@ -0,0 +1,183 @@
+import sys
+import struct
+from array import array
+from datetime import date
+
+# Exportación de grafos sin pasar por NetworkX: los nodos son enteros (en orden de aparición)
+# y las aristas viven en arreglos paralelos, que se escriben directo al archivo
+MAGIA_CSR = b'TWCSR001'
+BITS_NODO = 32
+MASCARA_NODO = (1 << BITS_NODO) - 1
+
+
+class Aristas:
+    __slots__ = ('nombres', 'origenes', 'destinos', 'pesos', 'dirigido')
+
+    def __init__(self, nombres, origenes, destinos, pesos=None, dirigido=True):
+        self.nombres = nombres
+        self.origenes = origenes
+        self.destinos = destinos
+        self.pesos = pesos
+        self.dirigido = dirigido
+
+def desde_contador(nombres, aristas, orden=None, dirigido=True):
+    # nombres: id -> nombre; aristas: pares (origen << BITS_NODO | destino, peso). Solo quedan los
+    # nodos que tocan alguna arista, renumerados en el orden en que salen de orden (por id si no se da)
+    origenes, destinos, pesos = array('l'), array('l'), array('l')
+    for clave, peso in aristas:
+        origenes.append(clave >> BITS_NODO)
+        destinos.append(clave & MASCARA_NODO)
+        pesos.append(peso)
+
+    usados = bytearray(len(nombres))
+    for u in origenes:
+        usados[u] = 1
+    for v in destinos:
+        usados[v] = 1
+
+    nuevo_id = array('l', [-1]) * len(nombres)
+    nombres_usados = []
+    for indice in (orden if orden is not None else range(len(nombres))):
+        if usados[indice] and nuevo_id[indice] < 0:
+            nuevo_id[indice] = len(nombres_usados)
+            nombres_usados.append(nombres[indice])
+    return Aristas(nombres_usados, array('l', (nuevo_id[u] for u in origenes)), array('l', (nuevo_id[v] for v in destinos)), pesos, dirigido)
+
+def construir_csr(grafo):
+    # Lista de adyacencia comprimida: los vecinos de u ocupan vecinos[inicio[u]:inicio[u + 1]],
+    # en el orden en que se agregaron las aristas. En los no dirigidos cada arista se guarda
+    # en ambos extremos (un lazo una sola vez), igual que la adyacencia de NetworkX
+    num_nodos = len(grafo.nombres)
+    inicio = array('q', bytes(8 * (num_nodos + 1)))
+    for u in grafo.origenes:
+        inicio[u + 1] += 1
+    if not grafo.dirigido:
+        for u, v in zip(grafo.origenes, grafo.destinos):
+            if u != v:
+                inicio[v + 1] += 1
+    for i in range(num_nodos):
+        inicio[i + 1] += inicio[i]
+
+    total = inicio[num_nodos]
+    vecinos = array('l', bytes(array('l').itemsize * total))
+    pesos = array('l', bytes(array('l').itemsize * total)) if grafo.pesos is not None else None
+    siguiente = array('q', inicio)
+    for i, (u, v) in enumerate(zip(grafo.origenes, grafo.destinos)):
+        extremos = ((u, v),) if grafo.dirigido or u == v else ((u, v), (v, u))
+        for a, b in extremos:
+            vecinos[siguiente[a]] = b
+            if pesos is not None:
+                pesos[siguiente[a]] = grafo.pesos[i]
+            siguiente[a] += 1
+    return inicio, vecinos, pesos
+
+def recorrer_aristas(grafo):
+    # Mismo orden que G.edges() de NetworkX: por nodo de origen y, en los no dirigidos,
+    # cada arista desde el primero de sus extremos
+    inicio, vecinos, pesos = construir_csr(grafo)
+    for u in range(len(grafo.nombres)):
+        for j in range(inicio[u], inicio[u + 1]):
+            v = vecinos[j]
+            if grafo.dirigido or v >= u:
+                yield u, v, pesos[j] if pesos is not None else None
+
+def escapar(texto):
+    return (texto.replace('&', '&amp;').replace('"', '&quot;').replace('<', '&lt;').replace('>', '&gt;')
+            .replace('\n', '&#10;').replace('\r', '&#13;').replace('\t', '&#09;'))
+
+def escribir_gexf(grafo, archivo):
+    nombres = [escapar(str(nombre)) for nombre in grafo.nombres]
+    with open(archivo, 'w', encoding='utf-8') as f_out:
+        f_out.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        f_out.write('<gexf xmlns="http://www.gexf.net/1.2draft" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                    'xsi:schemaLocation="http://www.gexf.net/1.2draft http://www.gexf.net/1.2draft/gexf.xsd" version="1.2">\n')
+        f_out.write('  <meta lastmodifieddate="%s">\n    <creator>generador.py</creator>\n  </meta>\n' % date.today().isoformat())
+        f_out.write('  <graph defaultedgetype="%s" mode="static" name="">\n' % ('directed' if grafo.dirigido else 'undirected'))
+
+        if nombres:
+            f_out.write('    <nodes>\n')
+            for nombre in nombres:
+                f_out.write('      <node id="%s" label="%s" />\n' % (nombre, nombre))
+            f_out.write('    </nodes>\n')
+        else:
+            f_out.write('    <nodes />\n')
+
+        numero = -1
+        for numero, (u, v, peso) in enumerate(recorrer_aristas(grafo)):
+            if numero == 0:
+                f_out.write('    <edges>\n')
+            if peso is None:
+                f_out.write('      <edge source="%s" target="%s" id="%d" />\n' % (nombres[u], nombres[v], numero))
+            else:
+                f_out.write('      <edge source="%s" target="%s" id="%d" weight="%d" />\n' % (nombres[u], nombres[v], numero, peso))
+        f_out.write('    </edges>\n' if numero >= 0 else '    <edges />\n')
+        f_out.write('  </graph>\n</gexf>\n')
+
+def escribir_graphml(grafo, archivo):
+    nombres = [escapar(str(nombre)) for nombre in grafo.nombres]
+    with open(archivo, 'w', encoding='utf-8') as f_out:
+        f_out.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        f_out.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                    'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">\n')
+        if grafo.pesos is not None:
+            f_out.write('  <key id="d0" for="edge" attr.name="weight" attr.type="long" />\n')
+        f_out.write('  <graph edgedefault="%s">\n' % ('directed' if grafo.dirigido else 'undirected'))
+        for nombre in nombres:
+            f_out.write('    <node id="%s" />\n' % nombre)
+        for u, v, peso in recorrer_aristas(grafo):
+            if peso is None:
+                f_out.write('    <edge source="%s" target="%s" />\n' % (nombres[u], nombres[v]))
+            else:
+                f_out.write('    <edge source="%s" target="%s">\n      <data key="d0">%d</data>\n    </edge>\n' % (nombres[u], nombres[v], peso))
+        f_out.write('  </graph>\n</graphml>\n')
+
+def escribir_aristas(grafo, archivo):
+    # Lista de aristas "origen destino [peso]" por línea (formato NCOL de igraph, se lee con Graph.Read_Ncol)
+    nombres = grafo.nombres
+    with open(archivo, 'w', encoding='utf-8') as f_out:
+        for u, v, peso in recorrer_aristas(grafo):
+            if peso is None:
+                f_out.write('%s %s\n' % (nombres[u], nombres[v]))
+            else:
+                f_out.write('%s %s %d\n' % (nombres[u], nombres[v], peso))
+
+def escribir_csr(grafo, archivo):
+    # Binario: magia, cabecera <BBQQ> (dirigido, con pesos, nodos, vecinos), inicio en int64,
+    # vecinos y pesos en int32 little-endian y los nombres de los nodos separados por '\n'
+    inicio, vecinos, pesos = construir_csr(grafo)
+    columnas = [array('q', inicio), array('i', vecinos)]
+    if pesos is not None:
+        columnas.append(array('i', pesos))
+    with open(archivo, 'wb') as f_out:
+        f_out.write(MAGIA_CSR + struct.pack('<BBQQ', grafo.dirigido, pesos is not None, len(grafo.nombres), len(vecinos)))
+        for columna in columnas:
+            if sys.byteorder == 'big':
+                columna.byteswap()
+            columna.tofile(f_out)
+        f_out.write('\n'.join(map(str, grafo.nombres)).encode('utf-8'))
+
+def leer_csr(archivo):
+    # Devuelve (nombres, inicio, vecinos, pesos, dirigido) sin construir ningún objeto de grafo
+    with open(archivo, 'rb') as f_in:
+        if f_in.read(8) != MAGIA_CSR:
+            raise ValueError("No es un archivo CSR: %s" % archivo)
+        dirigido, con_pesos, num_nodos, num_vecinos = struct.unpack('<BBQQ', f_in.read(18))
+        columnas = []
+        for tipo, cantidad in [('q', num_nodos + 1), ('i', num_vecinos)] + ([('i', num_vecinos)] if con_pesos else []):
+            columna = array(tipo)
+            columna.fromfile(f_in, cantidad)
+            if sys.byteorder == 'big':
+                columna.byteswap()
+            columnas.append(columna)
+        texto = f_in.read().decode('utf-8')
+    nombres = texto.split('\n') if num_nodos else []
+    return nombres, columnas[0], columnas[1], columnas[2] if con_pesos else None, bool(dirigido)
+
+FORMATOS_GRAFO = {'gexf': ('.gexf', escribir_gexf),
+                  'graphml': ('.graphml', escribir_graphml),
+                  'aristas': ('.ncol', escribir_aristas),
+                  'csr': ('.csr', escribir_csr)}
+
+def exportar_grafo(grafo, nombre, formato='gexf'):
+    extension, escribir = FORMATOS_GRAFO[formato]
+    escribir(grafo, nombre + extension)
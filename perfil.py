@@ -0,0 +1,117 @@
+import sys
+import time
+import json
+import cProfile
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    # Windows no tiene resource: el reporte sale sin RSS pico
+    resource = None
+
+# Instrumentación opcional por etapa: tiempo de pared, volumen procesado y memoria pico.
+# Mientras no se llame a iniciar(), etapa() y contar() solo revisan la bandera activo
+activo = False
+memoria = False
+etapas = {}
+contadores = defaultdict(int)
+inicio_total = None
+perfilador = None
+
+
+def iniciar(con_memoria=False, con_cprofile=False):
+    global activo, memoria, inicio_total, perfilador
+    activo = True
+    inicio_total = time.perf_counter()
+    if con_memoria:
+        memoria = True
+        tracemalloc.start()
+    if con_cprofile:
+        perfilador = cProfile.Profile()
+        perfilador.enable()
+
+def reiniciar():
+    # En los procesos del pool: cada archivo se mide desde cero y se devuelve con parcial()
+    global activo
+    activo = True
+    etapas.clear()
+    contadores.clear()
+
+def rss_pico_mb(hijos=False):
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_CHILDREN if hijos else resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo entrega en KB y macOS en bytes
+    return pico / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+def sumar_tiempo(nombre, segundos, veces=1):
+    datos = etapas.get(nombre)
+    if datos is None:
+        datos = etapas[nombre] = {'segundos': 0.0, 'veces': 0}
+    datos['segundos'] += segundos
+    datos['veces'] += veces
+    return datos
+
+@contextmanager
+def etapa(nombre):
+    if not activo:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        datos = sumar_tiempo(nombre, time.perf_counter() - inicio)
+        # Pico de memoria alcanzado hasta el final de la etapa (no se reinicia entre etapas anidadas)
+        datos['rss_pico_mb'] = rss_pico_mb()
+        if memoria:
+            datos['tracemalloc_pico_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+
+def contar(nombre, cantidad=1):
+    if activo:
+        contadores[nombre] += cantidad
+
+def parcial():
+    return {'etapas': dict(etapas), 'contadores': dict(contadores)}
+
+def sumar(medicion):
+    # Junta en este proceso lo medido en un proceso del pool (tiempos sumados, no de pared)
+    for nombre, datos in medicion['etapas'].items():
+        sumar_tiempo(nombre + '_workers', datos['segundos'], datos['veces'])
+    for nombre, cantidad in medicion['contadores'].items():
+        contadores[nombre] += cantidad
+
+def tasa(cantidad, nombre_etapa):
+    segundos = etapas.get(nombre_etapa, {}).get('segundos', 0)
+    return cantidad / segundos if segundos > 0 else None
+
+def reporte(rank=0):
+    lectura = 'lectura'
+    descompresion = 'descompresion' if 'descompresion' in etapas else 'descompresion_workers'
+    datos = {'rank': rank,
+             'segundos_total': time.perf_counter() - inicio_total,
+             'rss_pico_mb': rss_pico_mb(),
+             'rss_pico_hijos_mb': rss_pico_mb(hijos=True),
+             'etapas': etapas,
+             'contadores': dict(contadores),
+             'tasas': {'tweets_por_segundo': tasa(contadores['tweets'], lectura),
+                       'lineas_por_segundo': tasa(contadores['lineas'], lectura),
+                       'bytes_comprimidos_por_segundo': tasa(contadores['bytes_comprimidos'], lectura),
+                       'bytes_descomprimidos_por_segundo': tasa(contadores['bytes_descomprimidos'], descompresion)}}
+    if memoria:
+        # Las líneas de código que más memoria tienen asignada al final de la corrida
+        datos['asignaciones'] = [{'lugar': str(estadistica.traceback), 'mb': estadistica.size / 1e6}
+                                 for estadistica in tracemalloc.take_snapshot().statistics('lineno')[:10]]
+    return datos
+
+def terminar(archivo_cprofile=None):
+    if perfilador is not None:
+        perfilador.disable()
+        if archivo_cprofile is not None:
+            perfilador.dump_stats(archivo_cprofile)
+
+def guardar_reporte(archivo, reportes, **extra):
+    with open(archivo, 'w') as file:
+        json.dump(dict(extra, reportes=reportes), file, indent=4, default=str)
@@ -0,0 +1,72 @@
+import os
+import bz2
+import sys
+import json
+import random
+import subprocess
+import pytest
+from bz2paralelo import leer_lineas, leer_lineas_solapado
+
+# Regresiones de la lectura: la tubería de -tb con archivos con basura después del flujo bzip2 y la
+# descompresión por bloques (-wbz2) dentro de los procesos de -w. Se corren con python -m pytest
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+LIMITE_SEGUNDOS = 120
+
+def escribir_archivo(archivo, numero, tweets, rng, basura=False, nivel=9):
+    # Retweets de u<i> al autor a<numero>, con texto al azar para que el bzip2 no los comprima demasiado
+    lineas = [json.dumps({'created_at': 'Mon Feb 01 %02d:00:00 +0000 2016' % numero, 'id_str': '%d%06d' % (numero, i),
+                          'text': '%064x' % rng.getrandbits(256), 'user': {'screen_name': 'u%d' % i},
+                          'entities': {'hashtags': [], 'user_mentions': []},
+                          'retweeted_status': {'created_at': 'Mon Feb 01 00:00:00 +0000 2016', 'id_str': str(numero), 'text': '',
+                                               'user': {'screen_name': 'a%d' % numero}, 'entities': {'hashtags': [], 'user_mentions': []}}})
+              for i in range(tweets)]
+    with open(archivo, 'wb') as file:
+        file.write(bz2.compress(('\n'.join(lineas) + '\n').encode('utf-8'), nivel) + (b'\x00GARBAGE' if basura else b''))
+
+def correr_generador(directorio, salida, opciones):
+    os.makedirs(salida)
+    subprocess.run([sys.executable, os.path.join(DIRECTORIO, 'generador.py'), '-d', str(directorio), '-jrt'] + opciones,
+                   cwd=salida, check=True, stdout=subprocess.DEVNULL, timeout=LIMITE_SEGUNDOS)
+    with open(os.path.join(salida, 'rt.json')) as file:
+        return json.load(file)
+
+@pytest.fixture(scope='module')
+def con_basura(tmp_path_factory):
+    # Archivos con basura al final (el tercero de más de un trozo comprimido de 1 MB) seguidos de archivos normales
+    directorio = tmp_path_factory.mktemp('basura')
+    rng = random.Random(0)
+    archivos = []
+    for numero, (tweets, basura) in enumerate([(50, True), (60, False), (40000, True), (70, False)]):
+        archivo = os.path.join(directorio, '%02d.json.bz2' % numero)
+        escribir_archivo(archivo, numero, tweets, rng, basura)
+        archivos.append(archivo)
+    return directorio, archivos
+
+@pytest.fixture(scope='module')
+def varios_bloques(tmp_path_factory):
+    # Con nivel 1 los bloques bzip2 son de 100 KB, así cada archivo tiene varios y -wbz2 los reparte
+    directorio = tmp_path_factory.mktemp('bloques')
+    rng = random.Random(1)
+    for numero in range(3):
+        escribir_archivo(os.path.join(directorio, '%02d.json.bz2' % numero), numero, 2000, rng, nivel=1)
+    return directorio
+
+def test_tuberia_separa_archivos_con_basura(con_basura):
+    _, archivos = con_basura
+    leidos = [(archivo, list(lineas)) for archivo, lineas in leer_lineas_solapado(archivos, 1, 1)]
+    assert [archivo for archivo, _ in leidos] == archivos
+    for archivo, lineas in leidos:
+        assert lineas == list(leer_lineas(archivo)), os.path.basename(archivo)
+
+def test_generador_con_tuberia_igual_que_sin(con_basura, tmp_path):
+    directorio, _ = con_basura
+    assert correr_generador(directorio, tmp_path / 'tb', ['-tb']) == correr_generador(directorio, tmp_path / 'normal', [])
+
+def test_varios_bloques_por_archivo(varios_bloques):
+    archivo = os.path.join(varios_bloques, '00.json.bz2')
+    assert list(leer_lineas(archivo, 2)) == list(leer_lineas(archivo))
+
+def test_workers_con_workers_bz2_termina(varios_bloques, tmp_path):
+    # Cada proceso de -w descomprime con su propio pool de -wbz2; antes se quedaba colgado al terminar
+    esperado = correr_generador(varios_bloques, tmp_path / 'normal', [])
+    assert correr_generador(varios_bloques, tmp_path / 'bloques', ['-w', '2', '-wbz2', '2']) == esperado